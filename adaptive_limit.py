@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN = 30
+BASELINE_DRIFT = 0.001
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    # Opens after `failures` consecutive failed requests and rejects requests for `cooldown` seconds,
+    # then lets a single trial request through; its outcome closes the circuit or opens it again
+    def __init__(self, failures=DEFAULT_BREAKER_FAILURES, cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.trips = 0
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self):
+        # Called with the limiter's lock held
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._trial_running = False
+            logger.info("Circuit half-open: sending a trial request")
+
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+
+        retry_in = max(self.cooldown - (time.monotonic() - self._opened_at), 0)
+        raise CircuitOpenError(f"Error: circuit open after {self._consecutive_failures} consecutive failures, retry in {retry_in:.0f}s")
+
+    def record(self, ok):
+        if ok:
+            if self.state != CLOSED:
+                logger.info("Circuit closed: the trial request succeeded")
+            self.state = CLOSED
+            self._consecutive_failures = 0
+            return
+
+        self._consecutive_failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive_failures >= self.failures):
+            self.state = OPEN
+            self.trips += 1
+            self._opened_at = time.monotonic()
+            logger.warning(
+                f"Circuit open after {self._consecutive_failures} consecutive failures; "
+                f"rejecting requests for {self.cooldown}s"
+            )
+
+class AdaptiveLimiter:
+    # Additive-increase/multiplicative-decrease limit on requests in flight: the limit grows by one after a full
+    # window of healthy responses, and halves on an error or when latency exceeds latency_tolerance times the
+    # fastest recent latency. Requests over the limit wait in a queue.
+    def __init__(self, max_limit, initial_limit=1, min_limit=1, latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+                 breaker=None):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.limit = max(min(initial_limit, self.max_limit), self.min_limit)
+        self.latency_tolerance = latency_tolerance
+        self.breaker = breaker
+        self.in_flight = 0
+        self.waiting = 0
+        self._baseline = None
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            if self.breaker is not None:
+                self.breaker.allow()
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.limit:
+                    self._condition.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, ok=True):
+        latency = time.monotonic() - started
+        with self._condition:
+            self.in_flight -= 1
+            if self.breaker is not None:
+                self.breaker.record(ok)
+
+            if ok:
+                # The fastest latency seen, creeping slowly towards recent latencies so one lucky response
+                # can't pin it forever while sustained queueing still stands out against it
+                if self._baseline is None or latency < self._baseline:
+                    self._baseline = latency
+                else:
+                    self._baseline += (latency - self._baseline) * BASELINE_DRIFT
+
+            overloaded = not ok or (self._baseline is not None and latency > self._baseline * self.latency_tolerance)
+            if overloaded:
+                # Requests already in flight when the limit dropped report the same overload, so decrease once per episode
+                if started > self._last_decrease:
+                    self._set_limit(max(self.limit // 2, self.min_limit), "error" if not ok else f"latency {latency:.2f}s")
+                    self._last_decrease = time.monotonic()
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self._successes = 0
+                    self._set_limit(self.limit + 1, "healthy responses")
+
+            self._condition.notify_all()
+
+    def _set_limit(self, limit, reason):
+        if limit != self.limit:
+            logger.info(f"Concurrency limit {self.limit} -> {limit} ({reason}); {self.status()}")
+            self.limit = limit
+
+    def status(self):
+        circuit = f", circuit {self.breaker.state}" if self.breaker is not None else ""
+        return f"limit {self.limit}, {self.in_flight} in flight, {self.waiting} queued{circuit}"
+
+    def log_summary(self):
+        trips = f", circuit breaker tripped {self.breaker.trips} times" if self.breaker is not None else ""
+        logger.info(f"Adaptive concurrency finished at {self.status()}{trips}")
+
+def add_limiter_arguments(group):
+    group.add_argument("--adaptive-concurrency", action="store_true",
+                       help="Adjust the number of requests in flight (up to the number of workers) from observed latency and errors")
+    group.add_argument("--latency-tolerance", type=float, default=DEFAULT_LATENCY_TOLERANCE,
+                       help="Halve the concurrency limit when a response takes this many times the fastest recent response")
+    group.add_argument("--breaker-failures", type=int, default=DEFAULT_BREAKER_FAILURES,
+                       help="With --adaptive-concurrency, consecutive failed requests that open the circuit breaker (0 disables it)")
+    group.add_argument("--breaker-cooldown", type=float, default=DEFAULT_BREAKER_COOLDOWN,
+                       help="Seconds the circuit breaker rejects requests before sending a trial request")
+
+def limiter_from_args(args, workers=1):
+    if not args.adaptive_concurrency:
+        return None
+    breaker = CircuitBreaker(args.breaker_failures, args.breaker_cooldown) if args.breaker_failures > 0 else None
+    return AdaptiveLimiter(max(workers, 1), latency_tolerance=args.latency_tolerance, breaker=breaker)
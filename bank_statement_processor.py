@@ -1,131 +1,127 @@
-import json
 import csv
 import os
+import re
 import logging
+import threading
 from datetime import datetime
 import argparse
-import requests
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from ollama_client import OllamaClient, add_client_arguments, client_from_args, warm_up_model, release_model
+from categorization import load_category_keywords, format_response, batch_system_prompt, categorize_in_batch, read_until_complete, group_key, parse_category, add_compact_arguments, generate_compact
+from statement_reader import iter_statement_rows, parse_account_detail, HEADER, TRANSACTION
+from ledger import add_ledger_arguments, ledger_from_args
+from transaction_store import account_name, add_store_arguments, call_summary, store_from_args
+from embedding_index import add_knn_arguments, categorize_with_neighbours, knn_from_args
+from cascade import add_cascade_arguments, cascade_from_args
+from metrics import MetricsCollector, add_metrics_arguments, write_reports
+from multi_statement import BoundedExecutor, add_multi_statement_arguments, expand_inputs, is_multi_input, output_names, run_statements
+from response_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE_DAYS
+
+# How often the adaptive concurrency limit and queue depth are logged, in transactions read
+STATUS_EVERY = 100
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
+class KeywordIndex:
+    def __init__(self, categories):
+        self.remarks = {category: details['remark'] for category, details in categories.items()}
+        self.category_order = {category: i for i, category in enumerate(categories)}
 
-    def generate(self, prompt, model="llama3.1:8b", stream=False):
-        url = f"{self.base_url}/api/generate"
-        
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": stream
-        }
+        # Map each keyword to every category that lists it, e.g. "gas" is both Transportation and Utilities
+        self.keyword_categories = {}
+        for category, details in categories.items():
+            for keyword in details['keywords']:
+                keyword_categories = self.keyword_categories.setdefault(keyword.lower(), [])
+                if category not in keyword_categories:
+                    keyword_categories.append(category)
 
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
-
-def read_csv_file(file_path):
-    with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        return list(reader)
-
-# Demo JSON structure for categories, keywords, and remarks
-DEFAULT_CATEGORIES = {
-    "Income": {
-        "keywords": ["upwork", "paypal", "dividend", "interest", "refund"],
-        "remark": "Earnings, payments received, or other income (Credit transactions only)"
-    },
-    "Housing": {
-        "keywords": ["rent", "mortgage", "repair"],
-        "remark": "Rent, mortgage, home repairs, etc."
-    },
-    "Transportation": {
-        "keywords": ["fuel", "gas", "car", "bus", "train", "uber", "lyft", "ola"],
-        "remark": "Fuel, car payments, public transport, etc."
-    },
-    "Food": {
-        "keywords": ["grocery", "restaurant", "cafe", "food", "zomato", "swigy"],
-        "remark": "Groceries, dining out, etc."
-    },
-    "Utilities": {
-        "keywords": ["electricity", "water", "gas", "internet", "phone", "jio", "airtel", "phone"],
-        "remark": "Electricity, water, gas, internet, phone bills, etc."
-    },
-    "Insurance": {
-        "keywords": ["insurance", "policy"],
-        "remark": "Health, car, home, life insurance, etc."
-    },
-    "Medical & Healthcare": {
-        "keywords": ["doctor", "hospital", "pharmacy", "medicine"],
-        "remark": "Doctor visits, medications, etc."
-    },
-    "Savings & Investments": {
-        "keywords": ["savings", "investment", "stocks", "bonds"],
-        "remark": "Deposits to savings accounts, investments, etc."
-    },
-    "Personal Spending": {
-        "keywords": ["clothing", "entertainment", "personal"],
-        "remark": "Clothing, entertainment, personal care, etc."
-    },
-    "Recreation & Entertainment": {
-        "keywords": ["movie", "sport", "hobby", "game", "netflix"],
-        "remark": "Movies, sports, hobbies, etc."
-    },
-    "Investment": {
-        "keywords": ["INDMoney"],
-        "remark": "invest to stock or SIP"
-    },
-    "business": {
-        "keywords": ["AWS"],
-        "remark": "Business expenses"
-    },
-    "Tax": {
-        "keywords": ["tax", "Income tax"],
-         "remark": "TAX related expenses"
-    },
-    "Miscellaneous": {
-        "keywords": ["random"],
-        "remark": "rando small ammounts among friends"
-    }
-}
-
-def load_category_keywords(json_file=None):
-    if json_file:
-        with open(json_file, 'r') as f:
-            return json.load(f)
-    else:
-        return DEFAULT_CATEGORIES
+        # One alternation for all keywords, longest first so "income tax" wins over "tax"
+        keywords = sorted(self.keyword_categories, key=len, reverse=True)
+        self.pattern = None
+        if keywords:
+            self.pattern = re.compile(
+                r"(?<!\w)(?:" + "|".join(re.escape(keyword) for keyword in keywords) + r")(?!\w)",
+                re.IGNORECASE
+            )
+
+    def match(self, description):
+        if self.pattern is None:
+            return []
 
-def categorize_transaction(client, model, transaction, categories):
+        matched = set()
+        for match in self.pattern.finditer(description):
+            matched.update(self.keyword_categories[match.group(0).lower()])
+        return sorted(matched, key=self.category_order.get)
+
+class CategorizationStats:
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, source):
+        with self._lock:
+            self.counts[source] += 1
+
+    def log_summary(self):
+        local = self.counts['keyword'] + self.counts['cache'] + self.counts['knn'] + self.counts['ledger']
+        logger.info(
+            f"Resolved {local} transactions locally (keyword: {self.counts['keyword']}, cache: {self.counts['cache']}, "
+            f"nearest neighbours: {self.counts['knn']}, ledger: {self.counts['ledger']}), "
+            f"{self.counts['model']} by the model, {self.counts['error']} errors"
+        )
+        if self.counts['fast_model']:
+            logger.info(f"{self.counts['fast_model']} of the model answers came from the fast model without escalating")
+        if self.counts['deduplicated']:
+            groups = local + self.counts['model'] + self.counts['error']
+            transactions = groups + self.counts['deduplicated']
+            logger.info(
+                f"Deduplicated {transactions} transactions into {groups} merchant groups "
+                f"({transactions / groups:.1f}x fewer categorizations)"
+            )
+        if self.counts['batch_fallback']:
+            logger.info(f"{self.counts['batch_fallback']} transactions fell back to per-row calls after a batch answer")
+
+def describe_transaction(transaction):
     txn_date, value_date, description, ref_no, debit, credit, balance = transaction
 
     # Determine the transaction type and amount
     if debit and debit.strip() != '':
-        transaction_type = "Debit (Money Out)"
-        amount = debit
+        return "Debit (Money Out)", debit
     elif credit and credit.strip() != '':
-        transaction_type = "Credit (Money In)"
-        amount = credit
+        return "Credit (Money In)", credit
     else:
-        transaction_type = "Unknown"
-        amount = "0"
+        return "Unknown", "0"
 
+def suggest_category(keyword_index, description, transaction_type):
     # Check for keyword matches
-    matched_category = None
-    matched_remark = None
-    for category, details in categories.items():
-        if any(keyword.lower() in description.lower() for keyword in details['keywords']):
-            matched_category = category
-            matched_remark = details['remark']
-            break
+    matched_categories = keyword_index.match(description)
+    if transaction_type != "Credit (Money In)" and "Income" in matched_categories:
+        # Income is only valid for credits, so it cannot be trusted as a suggestion here
+        matched_categories.remove("Income")
+        trusted_match = False
+    else:
+        trusted_match = len(matched_categories) == 1
 
-    prompt = f"""Analyze and categorize this bank transaction:
+    matched_category = matched_categories[0] if matched_categories else None
+    matched_remark = keyword_index.remarks[matched_category] if matched_category else None
+    return matched_category, matched_remark, trusted_match
+
+CATEGORIZATION_RULES = """Rules:
+1. Credit = Money In, Debit = Money Out
+2. Income only for Credit transactions (earnings/payments received)
+3. Never use Income for Debit transactions
+4. Person-to-person transactions = Personal Spending
+5. If no suitable category, use your best guess to assing one category and Explanation\""""
+
+def build_prompt(transaction, categories, matched_category, matched_remark):
+    txn_date, value_date, description, ref_no, debit, credit, balance = transaction
+    transaction_type, amount = describe_transaction(transaction)
+
+    return f"""Analyze and categorize this bank transaction:
 
 Date: {txn_date}
 Description: {description}
@@ -137,90 +133,440 @@ Amount: {amount}
 
 Categorize into ONE of: {', '.join(categories.keys())}
 
-Rules:
-1. Credit = Money In, Debit = Money Out
-2. Income only for Credit transactions (earnings/payments received)
-3. Never use Income for Debit transactions
-4. Person-to-person transactions = Personal Spending
-5. If no suitable category, use your best guess to assing one category and Explanation"
+{CATEGORIZATION_RULES}
 
 Format:
 Category: [category name or "No match"]
 Explanation: [brief justification]
 """
 
+def build_system_prompt(categories):
+    # Everything in build_prompt() that is the same for every transaction, so the server can reuse it as a cached prefix
+    return f"""Analyze and categorize each bank transaction you are given.
+
+Categorize into ONE of: {', '.join(categories.keys())}
+
+{CATEGORIZATION_RULES}
+
+Format:
+Category: [category name or "No match"]
+Explanation: [brief justification]
+"""
+
+def build_batch_instructions(categories):
+    return f"""Analyze and categorize each of the following bank transactions into ONE of: {', '.join(categories.keys())}
+
+{CATEGORIZATION_RULES}"""
+
+def build_batch_block(transaction, matched_category, matched_remark):
+    txn_date, value_date, description, ref_no, debit, credit, balance = transaction
+    transaction_type, amount = describe_transaction(transaction)
+
+    lines = [f"Date: {txn_date}", f"Description: {description}", f"Type: {transaction_type}", f"Amount: {amount}"]
+    if matched_category:
+        lines.append(f"Suggested: {matched_category} ({matched_remark})")
+    return "\n".join(lines)
+
+def build_request(transaction, categories, matched_category, matched_remark, system_prompt=False):
+    if system_prompt:
+        return dict(prompt=build_batch_block(transaction, matched_category, matched_remark),
+                    system=build_system_prompt(categories))
+    return dict(prompt=build_prompt(transaction, categories, matched_category, matched_remark))
+
+def categorize_transaction(client, model, transaction, categories, cache=None, keyword_index=None,
+                           trust_keywords=False, stats=None, stream=False, system_prompt=False, cascade=None, compact=None):
+    description = transaction[2]
+
+    if keyword_index is None:
+        keyword_index = KeywordIndex(categories)
+
+    transaction_type, amount = describe_transaction(transaction)
+    matched_category, matched_remark, trusted_match = suggest_category(keyword_index, description, transaction_type)
+
+    if trust_keywords and trusted_match:
+        logger.info(f"Categorized by keyword match without the model: {description} -> {matched_category}")
+        if stats is not None:
+            stats.record('keyword')
+        return format_response(matched_category, f"Keyword match - {matched_remark}")
+
+    prompt = build_prompt(transaction, categories, matched_category, matched_remark)
+
+    if cache is not None:
+        cached_response = cache.get(model, prompt)
+        if cached_response is not None:
+            logger.info(f"Using cached categorization for: {description}")
+            if stats is not None:
+                stats.record('cache')
+            return cached_response
+
+    # The full prompt stays the cache key, so answers are shared with and without the system prompt
+    request = build_request(transaction, categories, matched_category, matched_remark, system_prompt)
+
+    if cascade is not None:
+        answer = cascade.categorize(client, model, transaction, request, cache=cache, cache_prompt=prompt)
+        if answer is not None:
+            if stats is not None:
+                stats.record('model')
+                stats.record('fast_model')
+            return format_response(*answer)
+
     logger.info(f"Sending transaction to model for categorization: {description}")
     try:
-        response = client.generate(prompt, model=model)
-        category_response = response['response'].strip()
+        if compact is not None:
+            # compact is the explanation length in characters, or 0 for the category alone
+            category_response = format_response(*generate_compact(client, model, request, list(categories.keys()), compact))
+        elif stream:
+            category_response = read_until_complete(client.generate(model=model, stream=True, **request)).strip()
+        else:
+            response = client.generate(model=model, **request)
+            category_response = response['response'].strip()
         logger.debug(f"Raw model response: {category_response}")
 
+        if cache is not None:
+            cache.put(model, prompt, category_response)
+        if stats is not None:
+            stats.record('model')
+
         return category_response
 
     except Exception as e:
         logger.error(f"Error categorizing transaction: {e}")
+        if stats is not None:
+            stats.record('error')
         return f"Category: Error\nExplanation: Failed to categorize - {str(e)}"
 
-def process_file(input_file, output_folder, model, categories):
-    client = OllamaClient()
+def categorize_batch(client, model, transactions, categories, cache=None, keyword_index=None,
+                     trust_keywords=False, stats=None, stream=False, system_prompt=False, cascade=None, compact=None):
+    if keyword_index is None:
+        keyword_index = KeywordIndex(categories)
+
+    results = [None] * len(transactions)
+    positions = []
+    rows = []  # (transaction, prompt, request, batch block) for rows that keyword matching does not settle
+
+    for position, transaction in enumerate(transactions):
+        description = transaction[2]
+        transaction_type, amount = describe_transaction(transaction)
+        matched_category, matched_remark, trusted_match = suggest_category(keyword_index, description, transaction_type)
+
+        if trust_keywords and trusted_match:
+            logger.info(f"Categorized by keyword match without the model: {description} -> {matched_category}")
+            if stats is not None:
+                stats.record('keyword')
+            results[position] = format_response(matched_category, f"Keyword match - {matched_remark}")
+            continue
+
+        positions.append(position)
+        rows.append((
+            transaction,
+            build_prompt(transaction, categories, matched_category, matched_remark),
+            build_request(transaction, categories, matched_category, matched_remark, system_prompt),
+            build_batch_block(transaction, matched_category, matched_remark),
+        ))
+
+    def fallback(transaction):
+        return categorize_transaction(client, model, transaction, categories, keyword_index=keyword_index, stats=stats,
+                                      stream=stream, system_prompt=system_prompt, compact=compact)
+
+    answers = categorize_in_batch(client, model, rows, list(categories.keys()), build_batch_instructions(categories),
+                                  fallback, cache=cache, system_prompt=system_prompt, cascade=cascade, compact=compact,
+                                  record=stats.record if stats is not None else None)
+    for position, answer in zip(positions, answers):
+        results[position] = answer
+
+    return results
+
+def categorize_rows(client, model, transactions, categories, knn=None, stats=None, **options):
+    category_names = list(categories.keys())
+
+    def categorize_misses(misses):
+        if len(misses) > 1:
+            return categorize_batch(client, model, [transactions[i] for i in misses], categories, stats=stats, **options)
+        return [categorize_transaction(client, model, transactions[misses[0]], categories, stats=stats, **options)]
+
+    results, misses = categorize_with_neighbours(knn, transactions, categorize_misses,
+                                                 lambda answer: parse_category(answer, category_names),
+                                                 record=stats.record if stats is not None else None)
+    # Neighbour matches come back as (category, explanation)
+    return [format_response(*result) if isinstance(result, tuple) else result for result in results]
+
+def categorize_tracked(client, model, transactions, categories, **options):
+    # The rows' answers plus the (model, seconds per row) of the generate calls behind them, for the store
+    with client.track_calls() as calls:
+        results = categorize_rows(client, model, transactions, categories, **options)
+    return results, call_summary(calls, len(transactions))
+
+def read_statement(file_path):
+    # Used by the parse processes when several statements are processed together
+    return list(iter_statement_rows(file_path))
+
+def write_processed_row(writer, row, future, progress=None, input_file=None):
+    if future is None:
+        writer.writerow(row)
+        return
+
+    if progress is not None:
+        progress.advance(input_file)
+
+    try:
+        ai_remark = future.result()
+        writer.writerow(row + [ai_remark])
+        return ai_remark
+    except Exception as e:
+        logger.error(f"Error processing transaction: {e}")
+        writer.writerow(row + [f"Error: {str(e)}"])
+
+def resolve_batch(batch_future, row_futures, tracked=False):
+    # Hand each row of a finished batch its own result
+    try:
+        results = batch_future.result()
+    except Exception as e:
+        for future in row_futures:
+            future.set_exception(e)
+        return
+
+    results, call = results if tracked else (results, (None, None))
+    for future, result in zip(row_futures, results):
+        future.call = call
+        future.set_result(result)
+
+def process_file(input_file, output_folder, model, categories, workers=1, cache=None, trust_keywords=False,
+                 batch_size=1, client=None, stream=False, dedup=False, knn=None, metrics=None, system_prompt=False,
+                 rows=None, executor=None, progress=None, cascade=None, compact=None, ledger=None, store=None,
+                 output_name=None):
+    client = client or OllamaClient(pool_size=max(workers, 1))
+    keyword_index = KeywordIndex(categories)
+    stats = CategorizationStats()
 
     logger.info(f"Processing file: {input_file}")
+
+    # Rows are read lazily in a single pass; only the rows up to the 'Txn Date' header are read here
+    rows = iter(rows) if rows is not None else iter_statement_rows(input_file)
+    header_rows = []
     try:
-        csv_data = read_csv_file(input_file)
+        for kind, row in rows:
+            header_rows.append(row)
+            if kind == HEADER:
+                break
+    except ValueError as e:
+        logger.error(str(e))
+        return
     except Exception as e:
         logger.error(f"Error reading file: {e}")
         return
 
-    transaction_start_row = None
-    for i, row in enumerate(csv_data):
-        if row and row[0] == 'Txn Date':
-            transaction_start_row = i
-            break
+    # output_name tells apart statements of a multi-statement run that share a file name
+    output_file = os.path.join(output_folder, f"processed_{output_name or os.path.basename(input_file)}")
+    statement_name = os.path.basename(input_file)
+    account_details = dict(filter(None, map(parse_account_detail, header_rows)))
+    if ledger is not None:
+        ledger.record_statement(statement_name, account_details)
 
-    if transaction_start_row is None:
-        logger.error("Could not find transaction data in the file")
-        return
+    # Keep a bounded window of rows in flight so the writer can emit them in
+    # their original order while the workers categorize ahead of it
+    max_pending = max(workers, 1) * max(batch_size, 1) * 4
 
-    output_file = os.path.join(output_folder, f"processed_{os.path.basename(input_file)}")
-    
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+    # Several statements processed together share one executor, and with it one bounded queue of model requests
+    executor_context = nullcontext(executor) if executor is not None else ThreadPoolExecutor(max_workers=max(workers, 1))
+
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile, executor_context as executor:
         writer = csv.writer(csvfile)
         
         # Write header rows
-        for row in csv_data[:transaction_start_row+1]:
+        for row in header_rows:
             writer.writerow(row + ['AI Category and Explanation'])
-        
+
+        options = dict(cache=cache, keyword_index=keyword_index, trust_keywords=trust_keywords, stats=stats, stream=stream,
+                       system_prompt=system_prompt, cascade=cascade, compact=compact)
+        pending = deque()
+        batch_rows = []
+        groups = {}  # (merchant key, direction) -> future of the first transaction in the group
+        transactions_read = 0
+        transactions_written = 0
+        occurrences = {}
+        category_names = list(categories.keys())
+
+        def write_next():
+            nonlocal transactions_written
+            row, future, reused = pending.popleft()
+            answer = write_processed_row(writer, row, future, progress, input_file)
+            # Only answers naming a category go into the ledger, so errors are retried by the next run
+            category = parse_category(answer, category_names) if answer else None
+            if ledger is not None and category is not None:
+                ledger.put(row[:7], category, answer, model, statement_name)
+            if store is not None and (future is not None or reused):
+                # Rows filled from the ledger or from a repeated merchant made no model call of their own
+                call_model, latency = (None, None) if reused else getattr(future, 'call', (None, None))
+                if future is None:
+                    category = parse_category(row[7], category_names)
+                store.append(account_name(account_details), statement_name, row[:7], category, call_model, latency,
+                             sequence=transactions_written, occurrences=occurrences)
+                transactions_written += 1
+
+        def submit_batch():
+            if not batch_rows:
+                return
+            transactions = [row[:7] for row, _ in batch_rows]
+            row_futures = [future for _, future in batch_rows]
+            categorize = categorize_tracked if store is not None else categorize_rows
+            batch_future = executor.submit(categorize, client, model, transactions, categories, knn=knn, **options)
+            batch_future.add_done_callback(
+                lambda done, row_futures=row_futures: resolve_batch(done, row_futures, tracked=store is not None)
+            )
+            batch_rows.clear()
+
         # Process and write transaction rows
-        for row in csv_data[transaction_start_row+1:]:
-            if row and len(row) >= 7:  # Ensure it's a valid transaction row
-                try:
-                    ai_remark = categorize_transaction(client, model, row[:7], categories)
-                    writer.writerow(row + [ai_remark])
-                except Exception as e:
-                    logger.error(f"Error processing transaction: {e}")
-                    writer.writerow(row + [f"Error: {str(e)}"])
+        for kind, row in rows:
+            known = ledger.get(row[:7]) if ledger is not None and kind == TRANSACTION else None
+            if known is not None:
+                # Seen in an earlier, overlapping statement, so it is written with the recorded answer
+                stats.record('ledger')
+                pending.append((row + [known], None, True))
+                if progress is not None:
+                    progress.advance(input_file)
+                if metrics is not None:
+                    metrics.add_rows(1)
+            elif kind == TRANSACTION:  # Ensure it's a valid transaction row
+                key = group_key(row[:7]) if dedup else None
+                reused = key in groups
+                if reused:
+                    # Same merchant and direction as an earlier row, so reuse its answer
+                    future = groups[key]
+                    stats.record('deduplicated')
+                else:
+                    future = Future()
+                    batch_rows.append((row, future))
+                    if len(batch_rows) >= batch_size:
+                        submit_batch()
+
+                if key is not None:
+                    groups.setdefault(key, future)
+                pending.append((row, future, reused))
+                if metrics is not None:
+                    metrics.add_rows(1)
+                transactions_read += 1
+                if client.limiter is not None and transactions_read % STATUS_EVERY == 0:
+                    logger.info(f"{input_file}: {transactions_read} transactions read, {len(pending)} rows waiting to be "
+                                f"written; concurrency {client.limiter.status()}")
             else:
-                writer.writerow(row)  # Write any other rows as-is
+                pending.append((row, None, False))  # Write any other rows as-is
+
+            while pending and (len(pending) > max_pending or pending[0][1] is None or pending[0][1].done()):
+                if len(pending) > max_pending:
+                    submit_batch()  # Never wait on a row whose batch has not been sent yet
+                write_next()
 
+        submit_batch()
+        while pending:
+            write_next()
+
+    stats.log_summary()
+    if cache is not None:
+        cache.log_stats()
     logger.info(f"Processing complete. File saved as {output_file}")
 
 def main():
     parser = argparse.ArgumentParser(description="Process bank statements using Ollama API")
-    parser.add_argument("--input", required=True, help="Path to the input file")
+    parser.add_argument("--input", required=True, help="Path to the input file, a directory of statements or a glob pattern")
     parser.add_argument("--output", required=True, help="Path to the output folder")
     parser.add_argument("--model", default="llama3.1:8b", help="Model to use for categorization")
     parser.add_argument("--log", default="info", choices=["debug", "info", "warning", "error"], help="Logging level")
     parser.add_argument("--categories", help="Path to the JSON file containing custom categories (optional)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of transactions to categorize in parallel (default: 1)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help=f"Path to the SQLite response cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Maximum number of cached responses to keep")
+    parser.add_argument("--cache-max-age-days", type=int, default=DEFAULT_MAX_AGE_DAYS, help="Discard cached responses older than this many days")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Number of transactions to send to the model in a single request (default: 1)")
+    parser.add_argument("--trust-keywords", action="store_true",
+                        help="Write unambiguous keyword matches directly without asking the model")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Categorize each merchant and direction once and reuse the answer for repeated transactions")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream model responses and stop reading once the Category and Explanation lines are complete")
+    parser.add_argument("--system-prompt", action="store_true",
+                        help="Send the categories and rules once as a fixed system prompt so Ollama can reuse its cached prefix")
+    add_client_arguments(parser)
+    add_cascade_arguments(parser)
+    add_compact_arguments(parser)
+    add_ledger_arguments(parser)
+    add_store_arguments(parser)
+    add_knn_arguments(parser)
+    add_metrics_arguments(parser)
+    add_multi_statement_arguments(parser)
     args = parser.parse_args()
 
     # Set logging level
+    logging.getLogger().setLevel(getattr(logging, args.log.upper()))
     logger.setLevel(getattr(logging, args.log.upper()))
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
     categories = load_category_keywords(args.categories)
-    process_file(args.input, args.output, args.model, categories)
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days)
+
+    metrics = MetricsCollector()
+    client = client_from_args(args, workers=args.workers, metrics=metrics)
+    knn = knn_from_args(args, client, list(categories.keys()))
+    cascade = cascade_from_args(args, list(categories.keys()), metrics)
+    ledger = ledger_from_args(args)
+    store = store_from_args(args)
+    try:
+        if args.keep_alive is not None or args.system_prompt:
+            # Load the model, and evaluate the shared system prompt, before the first transaction
+            system = None
+            if args.system_prompt and args.batch_size > 1:
+                system = batch_system_prompt(build_batch_instructions(categories))
+            elif args.system_prompt:
+                system = build_system_prompt(categories)
+            warm_up_model(client, args.model, system=system)
+            if cascade is not None and args.keep_alive is not None:
+                warm_up_model(client, cascade.fast_model)
+        options = dict(workers=args.workers, cache=cache, trust_keywords=args.trust_keywords, batch_size=args.batch_size,
+                       client=client, stream=args.stream, dedup=args.dedup, knn=knn, metrics=metrics,
+                       system_prompt=args.system_prompt, cascade=cascade,
+                       compact=args.explanation_chars if args.compact else None, ledger=ledger, store=store)
+
+        if is_multi_input(args.input):
+            input_files = expand_inputs(args.input)
+            names = output_names(input_files)
+            logger.info(f"Found {len(input_files)} statements in {args.input}")
+            max_queued = args.max_queued or max(args.workers, 1) * 4
+
+            with BoundedExecutor(args.workers, max_queued) as executor:
+                def process(input_file, rows, progress):
+                    progress.start(input_file, sum(1 for kind, _ in rows if kind == TRANSACTION))
+                    process_file(input_file, args.output, args.model, categories, rows=rows, executor=executor,
+                                 progress=progress, output_name=names[input_file], **options)
+
+                run_statements(input_files, read_statement, process, parse_workers=args.parse_workers,
+                               parallel_files=args.parallel_files or max(args.workers, 1))
+        else:
+            process_file(args.input, args.output, args.model, categories, **options)
+        if client.limiter is not None:
+            client.limiter.log_summary()
+        write_reports(metrics, args)
+    finally:
+        if knn is not None:
+            knn.index.save()
+        if args.keep_alive is not None:
+            release_model(client, args.model)
+            if cascade is not None:
+                release_model(client, cascade.fast_model)
+        client.close()
+        if cache is not None:
+            cache.close()
+        if ledger is not None:
+            ledger.log_stats()
+            ledger.close()
+        if store is not None:
+            store.close()
+            logger.info(f"Categorized transactions stored in {store.path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+import traceback
+
+# The processors live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_statement_processor
+import ollama_pdf_analysis
+from categorization import DEFAULT_CATEGORIES
+from metrics import MetricsCollector
+from ollama_client import OllamaClient
+from statement_reader import iter_statement_rows, TRANSACTION
+from stub_ollama_server import start_stub_server
+from synthetic_statement import write_statement
+
+PROCESSORS = ("bank", "pdf")
+POLL_SECONDS = 1.0
+
+class StageTimer:
+    # Time spent inside one stage of a processor's own run, measured by wrapping the function the stage calls
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+
+    def wrap_rows(self, function):
+        def timed(*args, **kwargs):
+            rows = function(*args, **kwargs)
+            while True:
+                started = time.perf_counter()
+                try:
+                    kind, row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds += time.perf_counter() - started
+                self.rows += kind == TRANSACTION
+                yield kind, row
+        return timed
+
+    def wrap_call(self, function):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - started
+        return timed
+
+def run_case(processor, statement, output_folder, base_url, options, results):
+    # Runs in its own process so peak RSS belongs to this case alone; a failure is reported instead of the result
+    try:
+        results.put(measure_case(processor, statement, output_folder, base_url, options))
+    except Exception:
+        results.put({"processor": processor, "error": traceback.format_exc()})
+
+def measure_case(processor, statement, output_folder, base_url, options):
+    logging.disable(logging.WARNING)
+    metrics = MetricsCollector()
+    client = OllamaClient(base_url, pool_size=max(options['workers'], 1), metrics=metrics)
+
+    # The processors read the statement lazily while they categorize, so parsing is timed inside their own row
+    # iterator; only the PDF processor writes its output as a separate stage
+    parse = StageTimer()
+    write = StageTimer()
+    bank_statement_processor.iter_statement_rows = parse.wrap_rows(iter_statement_rows)
+    ollama_pdf_analysis.iter_statement_rows = parse.wrap_rows(iter_statement_rows)
+    ollama_pdf_analysis.write_workbook = write.wrap_call(ollama_pdf_analysis.write_workbook)
+
+    process_started = time.perf_counter()
+    if processor == "bank":
+        bank_statement_processor.process_file(
+            statement, output_folder, options['model'], DEFAULT_CATEGORIES, workers=options['workers'],
+            batch_size=options['batch_size'], client=client, dedup=options['dedup'], metrics=metrics
+        )
+    else:
+        ollama_pdf_analysis.process_file(
+            statement, output_folder, options['model'], batch_size=options['batch_size'], client=client,
+            large_output=True, dedup=options['dedup'], metrics=metrics
+        )
+    process_seconds = time.perf_counter() - process_started
+
+    report = metrics.report()
+    rows = parse.rows
+    return {
+        "processor": processor,
+        "rows": rows,
+        "parse_seconds": parse.seconds,
+        "write_seconds": write.seconds if processor == "pdf" else None,
+        "process_seconds": process_seconds,
+        "model_call_seconds": report['model_seconds'],
+        "rows_per_sec": rows / process_seconds if process_seconds else 0.0,
+        "requests": report['calls'],
+        "errors": report['errors'],
+        "latency_p50": report['latency_p50'],
+        "latency_p95": report['latency_p95'],
+        "latency_p99": report['latency_p99'],
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def wait_for_result(process, results):
+    # Polls, so a case process that dies without reporting cannot hang the benchmark
+    while True:
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        try:
+            return results.get(timeout=POLL_SECONDS)  # Put just before the process exited
+        except queue.Empty:
+            return {"error": f"The benchmark process exited with code {process.exitcode} without a result"}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the statement processors against a stub Ollama server")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated statement sizes in rows")
+    parser.add_argument("--processors", default=",".join(PROCESSORS), help="Comma-separated processors to run (bank, pdf)")
+    parser.add_argument("--latency", default="fixed:0", help="Stub latency distribution: fixed:S, uniform:MIN,MAX or lognormal:MU,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests that fail with HTTP 503")
+    parser.add_argument("--model", default="llama3.1:8b", help="Model name sent to the stub")
+    parser.add_argument("--endpoints", type=int, default=1, help="Number of stub servers to balance requests across")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for bank_statement_processor")
+    parser.add_argument("--batch-size", type=int, default=1, help="Transactions per model request")
+    parser.add_argument("--dedup", action="store_true", help="Enable merchant deduplication")
+    parser.add_argument("--json", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    servers = [start_stub_server(latency=args.latency, error_rate=args.error_rate, models=[args.model])
+               for _ in range(max(args.endpoints, 1))]
+    base_url = ",".join(f"http://127.0.0.1:{server.server_address[1]}" for server in servers)
+    options = {"model": args.model, "workers": args.workers, "batch_size": args.batch_size, "dedup": args.dedup}
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            statement = os.path.join(workdir, f"statement_{size}.csv")
+            generate_started = time.perf_counter()
+            write_statement(statement, size)
+            generate_seconds = time.perf_counter() - generate_started
+
+            for processor in args.processors.split(','):
+                output_folder = os.path.join(workdir, f"{processor}_{size}")
+                os.makedirs(output_folder)
+                results_queue = context.Queue()
+                process = context.Process(target=run_case,
+                                          args=(processor, statement, output_folder, base_url, options, results_queue))
+                process.start()
+                result = wait_for_result(process, results_queue)
+                process.join()
+                result.update(processor=processor, size=size, generate_seconds=generate_seconds)
+                results.append(result)
+
+                if 'error' in result:
+                    print(f"{processor:>4} {size:>7} rows: failed\n{result['error']}", flush=True)
+                    continue
+                write = f"{result['write_seconds']:6.2f}s" if result['write_seconds'] is not None else "     -"
+                print(
+                    f"{processor:>4} {result['rows']:>7} rows: {result['rows_per_sec']:9.1f} rows/s, "
+                    f"parse {result['parse_seconds']:6.2f}s, write {write}, process {result['process_seconds']:7.2f}s, "
+                    f"model calls {result['model_call_seconds']:7.2f}s ({result['requests']} requests, {result['errors']} errors), "
+                    f"p50/p95/p99 {result['latency_p50'] * 1000:.1f}/{result['latency_p95'] * 1000:.1f}/{result['latency_p99'] * 1000:.1f}ms, "
+                    f"peak RSS {result['peak_rss_mb']:.1f} MB",
+                    flush=True
+                )
+
+    for server in servers:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.json}")
+
+if __name__ == "__main__":
+    main()
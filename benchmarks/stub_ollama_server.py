@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_CATEGORIES = ["Food", "Transportation", "Utilities", "Personal Spending", "Recreation & Entertainment", "Income"]
+EMBEDDING_DIMENSIONS = 64
+
+def parse_latency(spec):
+    # "fixed:0.05", "uniform:0.02,0.2" or "lognormal:-3,0.5" (mu and sigma of the underlying normal, in seconds)
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    elif kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    elif kind == "lognormal":
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def stable_choice(text, choices):
+    return choices[int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16) % len(choices)]
+
+class StubConfig:
+    def __init__(self, latency="fixed:0", error_rate=0.0, models=("llama3.1:8b",), categories=DEFAULT_CATEGORIES,
+                 responses=None, cold_load=0.0, capacity=0, model_latency=None):
+        self.latency = parse_latency(latency)
+        # Per-model latency overrides, e.g. a fast small model next to a slow large one
+        self.model_latency = {model: parse_latency(spec) for model, spec in (model_latency or {}).items()}
+        self.error_rate = error_rate
+        self.models = list(models)
+        self.categories = list(categories)
+        self.responses = responses
+        self.cold_load = cold_load
+        # Like a GPU, serve at most `capacity` generations at once and queue the rest (0 means unlimited)
+        self.slots = threading.Semaphore(capacity) if capacity else None
+        self.loaded_models = set()
+        self.cached_prefixes = {}  # model -> last system prompt, like the server's reusable prompt cache
+        self.requests = 0
+        self.lock = threading.Lock()
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this Nagle adds ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.send_json(200, {"models": [{"name": model} for model in self.config.models]})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self.config.lock:
+            self.config.requests += 1
+
+        if random.random() < self.config.error_rate:
+            self.send_json(503, {"error": "server busy"})
+            return
+
+        if self.path == '/api/embeddings':
+            self.send_json(200, {"embedding": self.embedding(payload.get('prompt', ''))})
+        elif self.path == '/api/generate':
+            self.generate(payload)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def embedding(self, text):
+        # Hashed bag of words without digits, so descriptions that differ only by reference numbers match
+        vector = [0.0] * EMBEDDING_DIMENSIONS
+        for word in re.split(r"[^A-Za-z]+", text.upper()):
+            if word:
+                vector[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1.0
+        return vector
+
+    def generate(self, payload):
+        model = payload.get('model', '')
+        if model not in self.config.models and f"{model}:latest" not in self.config.models:
+            self.send_json(404, {"error": f"model '{model}' not found"})
+            return
+
+        load_seconds = 0.0
+        with self.config.lock:
+            if model not in self.config.loaded_models:
+                self.config.loaded_models.add(model)
+                load_seconds = self.config.cold_load
+        system = payload.get('system', '')
+        prompt = payload.get('prompt', '')
+        with self.config.lock:
+            prefix_cached = bool(system) and self.config.cached_prefixes.get(model) == system
+            if prompt:
+                self.config.cached_prefixes[model] = system
+        if payload.get('keep_alive') in (0, "0", "0s"):
+            with self.config.lock:
+                self.config.loaded_models.discard(model)
+                self.config.cached_prefixes.pop(model, None)
+
+        if not prompt:
+            # Like Ollama, an empty prompt only loads the model: the system prompt is not evaluated and the reply
+            # carries no timings
+            time.sleep(load_seconds)
+            unloaded = payload.get('keep_alive') in (0, "0", "0s")
+            self.send_json(200, {"model": model, "response": "", "done": True, "done_reason": "unload" if unloaded else "load"})
+            return
+
+        sample = self.config.model_latency.get(model, self.config.latency)
+        latency = sample()
+        text = self.answer(prompt, system, payload.get('format'))
+        tokens = re.findall(r"\S+\s*", text) or []
+        num_predict = (payload.get('options') or {}).get('num_predict')
+        if num_predict is not None and num_predict > 0:
+            tokens = tokens[:num_predict]
+            text = "".join(tokens)
+        streaming = payload.get('stream', True)
+        metadata = {
+            "model": model,
+            "done": True,
+            "total_duration": int((load_seconds + latency) * 1e9),
+            "load_duration": int(load_seconds * 1e9) or 1_000_000,
+            "prompt_eval_count": len(prompt.split()) + (0 if prefix_cached else len(system.split())),
+            "prompt_eval_duration": int(latency * 0.3 * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(latency * 0.7 * 1e9),
+        }
+
+        # A streamed answer spends the eval part of the latency between its tokens, as a real model would
+        token_seconds = latency * 0.7 / len(tokens) if streaming and tokens else 0.0
+        slots = self.config.slots if self.config.slots is not None else nullcontext()
+        with slots:
+            time.sleep(load_seconds + latency - token_seconds * len(tokens))
+            self.send_answer(model, text, tokens, metadata, streaming, token_seconds)
+
+    def send_answer(self, model, text, tokens, metadata, streaming, token_seconds):
+        if not streaming:
+            self.send_json(200, dict(metadata, response=text))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(token_seconds)
+                self.write_chunk({"model": model, "response": token, "done": False})
+            self.write_chunk(dict(metadata, response=""))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading early
+
+    def write_chunk(self, body):
+        data = (json.dumps(body) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def answer(self, prompt, system, format):
+        categories = self.config.categories
+        blocks = re.findall(r"^\[(\d+)\]\n(.*?)(?=^\[\d+\]\n|\Z)", prompt, re.MULTILINE | re.DOTALL)
+
+        if isinstance(format, dict):
+            return json.dumps(self.schema_answer(format, prompt, blocks))
+        if format == "json" and blocks:
+            return json.dumps({"results": [
+                {"index": int(index), "category": stable_choice(block, categories), "explanation": "Stub batch answer"}
+                for index, block in blocks
+            ]})
+        if format == "json":
+            return json.dumps({"category": stable_choice(prompt, categories), "explanation": "Stub answer"})
+        if self.config.responses:
+            return stable_choice(prompt, self.config.responses)
+        return f"Category: {stable_choice(prompt, categories)}\nExplanation: Stub answer for benchmarking\n"
+
+    def schema_answer(self, schema, prompt, blocks=()):
+        answer = {}
+        for name, field in schema.get('properties', {}).items():
+            if field.get('type') == 'array':
+                # One item per transaction block of a batch prompt
+                answer[name] = [dict(self.schema_answer(field['items'], block), index=int(index)) for index, block in blocks]
+            elif 'enum' in field:
+                answer[name] = stable_choice(prompt, field['enum'])
+            elif field.get('type') == 'number' and field.get('maximum') == 1:
+                # A spread of confidence scores, so a cascade escalates some rows
+                answer[name] = stable_choice(prompt, [0.95, 0.9, 0.85, 0.8, 0.5])
+            elif field.get('type') in ('number', 'integer'):
+                answer[name] = 0.9
+            elif field.get('type') == 'string':
+                answer[name] = "Stub answer"[:field.get('maxLength')]
+        return answer
+
+def start_stub_server(host="127.0.0.1", port=0, **config):
+    # Serve on a background thread; port 0 picks a free port (see server.server_address)
+    server = ThreadingHTTPServer((host, port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.config = StubConfig(**config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Ollama server for benchmarks and tests")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=11434, help="Port to listen on")
+    parser.add_argument("--latency", default="fixed:0", help="Latency distribution: fixed:S, uniform:MIN,MAX or lognormal:MU,SIGMA")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SPEC",
+                        help="Latency distribution for one model, overriding --latency (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--models", default="llama3.1:8b,nomic-embed-text", help="Comma-separated models reported by /api/tags")
+    parser.add_argument("--cold-load", type=float, default=0.0, help="Seconds added to the first request for each model")
+    parser.add_argument("--capacity", type=int, default=0, help="Generations served at once; the rest queue (default: unlimited)")
+    parser.add_argument("--responses", help="JSON file with a list of canned responses for plain generate requests")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, 'r') as f:
+            responses = json.load(f)
+
+    server = start_stub_server(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                               models=args.models.split(','), responses=responses, cold_load=args.cold_load,
+                               capacity=args.capacity,
+                               model_latency=dict(spec.split('=', 1) for spec in args.model_latency))
+    print(f"Stub Ollama server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import csv
+import random
+from datetime import date, timedelta
+
+MERCHANTS = [
+    ("UPI/DR/{ref}/SWIGGY/YESB/swiggy@yespay/Food order", "debit"),
+    ("UPI/DR/{ref}/ZOMATO LTD/HDFC/zomato@hdfcbank/Payment", "debit"),
+    ("UPI/DR/{ref}/UBER INDIA/ICIC/uber@icici/Ride", "debit"),
+    ("POS {ref} INDIAN OIL FUEL STATION", "debit"),
+    ("ACH/DR/{ref}/AIRTEL BROADBAND", "debit"),
+    ("NACH/{ref}/LIC OF INDIA POLICY", "debit"),
+    ("UPI/DR/{ref}/APOLLO PHARMACY/SBIN/apollo@sbi/Medicine", "debit"),
+    ("INB/{ref}/NETFLIX SUBSCRIPTION", "debit"),
+    ("BY TRANSFER-NEFT-{ref}-AMAZON WEB SERVICES", "debit"),
+    ("UPI/DR/{ref}/RAHUL SHARMA/KKBK/rahul@kotak/Dinner split", "debit"),
+    ("ATM WDL {ref} MG ROAD", "debit"),
+    ("NEFT/CR/{ref}/UPWORK ESCROW INC", "credit"),
+    ("BY TRANSFER-INB-{ref}-INTEREST CREDIT", "credit"),
+    ("UPI/CR/{ref}/PRIYA NAIR/HDFC/priya@okhdfc/Refund", "credit"),
+]
+
+def write_statement(path, rows, seed=42, start=date(2021, 1, 1)):
+    # Same layout as the bank exports: account details, a blank line, then the 'Txn Date' table
+    rng = random.Random(seed)
+    end = start + timedelta(days=max(rows // 20, 1))
+    balance = 100000.0
+
+    with open(path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Account Name:", "Benchmark Account"])
+        writer.writerow(["Account Number:", "00000012345678"])
+        writer.writerow(["Start Date:", start.strftime("%d %b %Y")])
+        writer.writerow(["End Date:", end.strftime("%d %b %Y")])
+        writer.writerow([])
+        writer.writerow(["Txn Date", "Value Date", "Description", "Ref No./Cheque No.", "Debit", "Credit", "Balance"])
+
+        for i in range(rows):
+            template, direction = rng.choice(MERCHANTS)
+            ref = rng.randrange(10 ** 11, 10 ** 12)
+            txn_date = (start + timedelta(days=i * (end - start).days // max(rows, 1))).strftime("%d %b %Y")
+            amount = round(rng.uniform(50, 5000), 2)
+            balance += amount if direction == "credit" else -amount
+            writer.writerow([
+                txn_date, txn_date, template.format(ref=ref), f"TRF{ref}",
+                f"{amount:,.2f}" if direction == "debit" else "",
+                f"{amount:,.2f}" if direction == "credit" else "",
+                f"{balance:,.2f}",
+            ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic bank statement CSV")
+    parser.add_argument("--rows", type=int, default=1000, help="Number of transactions")
+    parser.add_argument("--output", required=True, help="Path of the CSV file to write")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    write_statement(args.output, args.rows, seed=args.seed)
+    print(f"Wrote {args.rows} transactions to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import json
+import logging
+import time
+from categorization import match_category, transaction_direction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_CONFIDENCE = 0.7
+NO_MATCH = "No match"
+
+FAST_RESPONSE_FORMAT = """Respond with a JSON object of this form instead, where confidence is how sure you are, from 0 to 1:
+{"category": "<category name or No match>", "confidence": <0 to 1>, "explanation": "<brief justification>"}"""
+
+def fast_response_schema(category_names):
+    # Ollama constrains the answer to this schema, so the category is always one of the names or "No match"
+    return {
+        "type": "object",
+        "properties": {
+            "category": {"type": "string", "enum": list(category_names) + [NO_MATCH]},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+            "explanation": {"type": "string"},
+        },
+        "required": ["category", "confidence", "explanation"],
+    }
+
+def parse_fast_response(text, category_names):
+    # (category, confidence, explanation); category is None when the answer is not a valid category
+    try:
+        data = json.loads(text)
+        confidence = float(data.get('confidence'))
+    except (ValueError, TypeError, AttributeError):
+        return None, 0.0, None
+
+    category = data.get('category', '')
+    category = NO_MATCH if str(category).strip().lower() == NO_MATCH.lower() else match_category(category, category_names)
+    explanation = data.get('explanation')
+    if not isinstance(explanation, str):
+        explanation = ""
+    return category, confidence, explanation.strip()
+
+class ModelCascade:
+    # Asks the fast model first and only escalates to the main model when its answer cannot be trusted
+    def __init__(self, fast_model, category_names, min_confidence=DEFAULT_MIN_CONFIDENCE, metrics=None):
+        self.fast_model = fast_model
+        self.category_names = list(category_names)
+        self.min_confidence = min_confidence
+        self.metrics = metrics
+        self.schema = fast_response_schema(self.category_names)
+
+    def escalation_reason(self, category, confidence, transaction):
+        if category is None:
+            return "invalid"
+        if category == NO_MATCH:
+            return "no match"
+        if confidence < self.min_confidence:
+            return "low confidence"
+        if category == "Income" and transaction_direction(transaction) == "debit":
+            return "income on debit"
+        return None
+
+    def categorize(self, client, model, transaction, request, cache=None, cache_prompt=None):
+        # (category, explanation) from the fast model, or None when the row should go to the main model.
+        # Accepted answers are cached under the fast model and the prompt with the JSON format it was sent with, so
+        # a rerun does not ask it again and a plain run with the same model never reads the JSON answer as its own.
+        cache_prompt = f"{cache_prompt}\n\n{FAST_RESPONSE_FORMAT}" if cache is not None and cache_prompt else None
+        cached = cache.get(self.fast_model, cache_prompt) if cache_prompt else None
+        if cached is not None:
+            category, confidence, explanation = parse_fast_response(cached, self.category_names)
+            if category is not None and self.escalation_reason(category, confidence, transaction) is None:
+                logger.info(f"Using cached {self.fast_model} categorization for: {transaction[2]}")
+                return category, explanation
+
+        request = dict(request, prompt=f"{request['prompt']}\n\n{FAST_RESPONSE_FORMAT}")
+        started = time.perf_counter()
+        try:
+            response = client.generate(model=self.fast_model, format=self.schema, **request)
+            category, confidence, explanation = parse_fast_response(response['response'], self.category_names)
+        except Exception as e:
+            logger.warning(f"Fast model {self.fast_model} failed, escalating to {model}: {e}")
+            category, confidence, explanation = None, 0.0, None
+        elapsed = time.perf_counter() - started
+
+        reason = self.escalation_reason(category, confidence, transaction)
+        if self.metrics is not None:
+            self.metrics.record_cascade(self.fast_model, model, reason, elapsed)
+        if reason is not None:
+            logger.info(f"Escalating to {model} ({reason}, confidence {confidence:.2f}): {transaction[2]}")
+            return None
+
+        logger.info(f"Categorized by {self.fast_model} (confidence {confidence:.2f}): {transaction[2]} -> {category}")
+        if cache_prompt:
+            cache.put(self.fast_model, cache_prompt, response['response'])
+        return category, explanation
+
+def add_cascade_arguments(parser):
+    group = parser.add_argument_group("Model cascade")
+    group.add_argument("--fast-model",
+                       help="Small model asked first; its answer is kept unless it is invalid, \"No match\", "
+                            "below --min-confidence or Income on a debit, in which case --model is asked")
+    group.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                       help=f"Lowest confidence from the fast model that is accepted without escalating (default: {DEFAULT_MIN_CONFIDENCE})")
+
+def cascade_from_args(args, category_names, metrics=None):
+    if not args.fast_model:
+        return None
+    return ModelCascade(args.fast_model, category_names, min_confidence=args.min_confidence, metrics=metrics)
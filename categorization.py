@@ -0,0 +1,320 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Demo JSON structure for categories, keywords, and remarks
+DEFAULT_CATEGORIES = {
+    "Income": {
+        "keywords": ["upwork", "paypal", "dividend", "interest", "refund"],
+        "remark": "Earnings, payments received, or other income (Credit transactions only)"
+    },
+    "Housing": {
+        "keywords": ["rent", "mortgage", "repair"],
+        "remark": "Rent, mortgage, home repairs, etc."
+    },
+    "Transportation": {
+        "keywords": ["fuel", "gas", "car", "bus", "train", "uber", "lyft", "ola"],
+        "remark": "Fuel, car payments, public transport, etc."
+    },
+    "Food": {
+        "keywords": ["grocery", "restaurant", "cafe", "food", "zomato", "swigy"],
+        "remark": "Groceries, dining out, etc."
+    },
+    "Utilities": {
+        "keywords": ["electricity", "water", "gas", "internet", "phone", "jio", "airtel", "phone"],
+        "remark": "Electricity, water, gas, internet, phone bills, etc."
+    },
+    "Insurance": {
+        "keywords": ["insurance", "policy"],
+        "remark": "Health, car, home, life insurance, etc."
+    },
+    "Medical & Healthcare": {
+        "keywords": ["doctor", "hospital", "pharmacy", "medicine"],
+        "remark": "Doctor visits, medications, etc."
+    },
+    "Savings & Investments": {
+        "keywords": ["savings", "investment", "stocks", "bonds"],
+        "remark": "Deposits to savings accounts, investments, etc."
+    },
+    "Personal Spending": {
+        "keywords": ["clothing", "entertainment", "personal"],
+        "remark": "Clothing, entertainment, personal care, etc."
+    },
+    "Recreation & Entertainment": {
+        "keywords": ["movie", "sport", "hobby", "game", "netflix"],
+        "remark": "Movies, sports, hobbies, etc."
+    },
+    "Investment": {
+        "keywords": ["INDMoney"],
+        "remark": "invest to stock or SIP"
+    },
+    "business": {
+        "keywords": ["AWS"],
+        "remark": "Business expenses"
+    },
+    "Tax": {
+        "keywords": ["tax", "Income tax"],
+         "remark": "TAX related expenses"
+    },
+    "Miscellaneous": {
+        "keywords": ["random"],
+        "remark": "rando small ammounts among friends"
+    }
+}
+
+def load_category_keywords(json_file=None):
+    if json_file:
+        with open(json_file, 'r') as f:
+            return json.load(f)
+    else:
+        return DEFAULT_CATEGORIES
+
+BATCH_RESPONSE_FORMAT = """Respond with a JSON object of this form, with exactly one entry per transaction index:
+{"results": [{"index": 0, "category": "<category name>", "explanation": "<brief justification>"}]}"""
+
+def format_response(category, explanation):
+    return f"Category: {category}\nExplanation: {explanation}"
+
+COMPLETE_CATEGORY = re.compile(r"^\s*Category:.*\n", re.IGNORECASE | re.MULTILINE)
+COMPLETE_EXPLANATION = re.compile(r"^\s*Explanation:.*\S.*\n", re.IGNORECASE | re.MULTILINE)
+
+def complete_categorization(text):
+    # The answer up to the end of the explanation line, once both lines have been terminated
+    if not COMPLETE_CATEGORY.search(text):
+        return None
+    explanation = COMPLETE_EXPLANATION.search(text)
+    return text[:explanation.end()] if explanation else None
+
+def read_until_complete(stream):
+    # Stop reading the stream as soon as the answer is complete instead of waiting for the model to finish
+    for _ in stream:
+        answer = complete_categorization(stream.response)
+        if answer is not None:
+            logger.debug("Categorization complete, closing the stream early")
+            stream.close()
+            return answer
+    return stream.response
+
+# Payment channels, transfer words and month names that vary between otherwise identical merchant descriptions
+CHANNEL_TOKENS = {
+    "UPI", "NEFT", "IMPS", "RTGS", "POS", "ATM", "ACH", "ECS", "NACH", "MB", "IB", "INB", "BIL", "ONL",
+    "DR", "CR", "TRF", "TRANSFER", "BY", "TO", "FROM", "REF", "TXN", "P2M", "P2A", "PAYMENT",
+    "JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
+}
+
+def merchant_key(description):
+    # Drop reference numbers, dates, times and anything else containing digits, plus the channel tokens
+    tokens = re.split(r"[^A-Z0-9&]+", description.upper())
+    merchant = [token for token in tokens if token and token not in CHANNEL_TOKENS and not re.search(r"\d", token)]
+    return " ".join(merchant) or description.strip().upper()
+
+def transaction_direction(transaction):
+    debit, credit = transaction[4], transaction[5]
+    if debit and debit.strip() != '':
+        return "debit"
+    elif credit and credit.strip() != '':
+        return "credit"
+    return "unknown"
+
+def group_key(transaction):
+    return merchant_key(transaction[2]), transaction_direction(transaction)
+
+def parse_category(text, category_names):
+    # The category named on the "Category:" line of a free-text answer, if it is one of category_names
+    line = re.search(r"^\s*Category:\s*(.+)$", text, re.IGNORECASE | re.MULTILINE)
+    return match_category(line.group(1), category_names) if line else None
+
+def match_category(value, category_names):
+    # Accept the exact name in any case, or the number from a numbered category list ("9" or "9. Personal Spending")
+    value = str(value).strip().strip('"').strip()
+    lowered = {name.lower(): name for name in category_names}
+    if value.lower() in lowered:
+        return lowered[value.lower()]
+
+    numbered = re.match(r"^(\d+)\.?\s*(.*)$", value)
+    if numbered:
+        number, rest = int(numbered.group(1)), numbered.group(2).strip()
+        if rest and rest.lower() in lowered:
+            return lowered[rest.lower()]
+        if not rest and 1 <= number <= len(category_names):
+            return list(category_names)[number - 1]
+
+    return None
+
+def build_batch_prompt(instructions, transaction_blocks):
+    # Without instructions only the transactions are listed, for use with batch_system_prompt()
+    sections = [instructions, "", "Transactions:"] if instructions else ["Transactions:"]
+    for index, block in enumerate(transaction_blocks):
+        sections.append(f"\n[{index}]\n{block}")
+    if instructions:
+        sections.append("")
+        sections.append(BATCH_RESPONSE_FORMAT)
+    return "\n".join(sections)
+
+def batch_system_prompt(instructions):
+    return f"{instructions}\n\n{BATCH_RESPONSE_FORMAT}"
+
+def parse_batch_response(text, count, category_names, require_explanation=True):
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        logger.warning(f"Batch response is not valid JSON: {e}")
+        return {}
+
+    if isinstance(data, dict):
+        data = data.get('results', [data] if 'index' in data else [])
+    if not isinstance(data, list):
+        logger.warning("Batch response does not contain a list of results")
+        return {}
+
+    results = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get('index'))
+        except (TypeError, ValueError):
+            continue
+
+        category = match_category(item.get('category', ''), category_names)
+        explanation = item.get('explanation', None if require_explanation else "")
+        if not 0 <= index < count or index in results or category is None or not isinstance(explanation, str):
+            logger.debug(f"Discarding malformed batch item: {item}")
+            continue
+
+        results[index] = (category, explanation.strip())
+
+    return results
+
+def categorize_in_batch(client, model, rows, category_names, instructions, fallback, cache=None, system_prompt=False,
+                        cascade=None, compact=None, record=None):
+    # rows are (transaction, prompt, request, batch block) as built by the processor; returns one answer per row
+    # in "Category: ...\nExplanation: ..." form. fallback(transaction) asks about a single row, and record(source)
+    # counts where each answer came from.
+    record = record or (lambda source: None)
+    results = [None] * len(rows)
+    pending = []  # (position, transaction, prompt, batch block) for rows that need the main model
+
+    for position, (transaction, prompt, request, block) in enumerate(rows):
+        # The single-row prompt is still the cache key, so batched and per-row runs share entries
+        cached_response = cache.get(model, prompt) if cache is not None else None
+        if cached_response is not None:
+            logger.info(f"Using cached categorization for: {transaction[2]}")
+            record('cache')
+            results[position] = cached_response
+            continue
+
+        # Only the rows the fast model cannot answer with confidence go into the batch for the main model
+        if cascade is not None:
+            answer = cascade.categorize(client, model, transaction, request, cache=cache, cache_prompt=prompt)
+            if answer is not None:
+                record('model')
+                record('fast_model')
+                results[position] = format_response(*answer)
+                continue
+
+        pending.append((position, transaction, prompt, block))
+
+    batch_results = {}
+    if len(pending) > 1:
+        blocks = [block for _, _, _, block in pending]
+        if system_prompt:
+            request = dict(prompt=build_batch_prompt(None, blocks), system=batch_system_prompt(instructions))
+        else:
+            request = dict(prompt=build_batch_prompt(instructions, blocks))
+
+        format, options = "json", None
+        if compact is not None:
+            format, options = compact_batch_schema(category_names, compact), compact_options(compact, len(pending))
+
+        logger.info(f"Sending batch of {len(pending)} transactions to model for categorization")
+        try:
+            response = client.generate(model=model, format=format, options=options, **request)
+            logger.debug(f"Raw batch response: {response['response']}")
+            batch_results = parse_batch_response(response['response'], len(pending), category_names,
+                                                 require_explanation=compact is None)
+        except Exception as e:
+            logger.error(f"Error categorizing batch: {e}")
+
+    for batch_index, (position, transaction, prompt, _) in enumerate(pending):
+        if batch_index in batch_results:
+            category, explanation = batch_results[batch_index]
+            logger.info(f"Categorized transaction: Category = {category}, Explanation = {explanation}")
+            record('model')
+            results[position] = format_response(category, explanation)
+        else:
+            # Missing or malformed in the batch answer, so ask about this row on its own
+            if len(pending) > 1:
+                logger.info(f"Falling back to a single request for: {transaction[2]}")
+                record('batch_fallback')
+            results[position] = fallback(transaction)
+            if results[position].startswith("Category: Error"):
+                continue
+        if cache is not None:
+            cache.put(model, prompt, results[position])
+
+    return results
+
+DEFAULT_EXPLANATION_CHARS = 80
+COMPACT_CATEGORY_TOKENS = 24  # Braces, keys and the longest category name
+
+def compact_response_format(explanation_chars):
+    if explanation_chars:
+        return f'Respond only with JSON: {{"category": "<category name>", "explanation": "<at most {explanation_chars} characters>"}}'
+    return 'Respond only with JSON: {"category": "<category name>"}'
+
+def compact_schema(category_names, explanation_chars):
+    # The enum makes the server's grammar emit one of the category names and nothing else
+    properties = {"category": {"type": "string", "enum": list(category_names)}}
+    if explanation_chars:
+        properties["explanation"] = {"type": "string", "maxLength": explanation_chars}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+def compact_batch_schema(category_names, explanation_chars):
+    item = compact_schema(category_names, explanation_chars)
+    item["properties"] = dict(index={"type": "integer"}, **item["properties"])
+    item["required"] = ["index"] + item["required"]
+    return {"type": "object", "properties": {"results": {"type": "array", "items": item}}, "required": ["results"]}
+
+def compact_options(explanation_chars, rows=1):
+    # Cap generation at the longest valid answer; a token is about four characters, so a third leaves headroom
+    return {"num_predict": (COMPACT_CATEGORY_TOKENS + explanation_chars // 3) * rows}
+
+def parse_compact_response(text, category_names):
+    # (category, explanation), or None unless the answer is a JSON object naming one of category_names
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    category = match_category(data.get('category', ''), category_names)
+    if category is None:
+        return None
+    explanation = data.get('explanation')
+    return category, explanation.strip() if isinstance(explanation, str) else ""
+
+def generate_compact(client, model, request, category_names, explanation_chars=DEFAULT_EXPLANATION_CHARS):
+    # One retry on an invalid answer, without the explanation, since running out of tokens mid-explanation is
+    # the usual way a constrained answer ends up incomplete
+    attempts = [explanation_chars, 0]
+    for attempt, chars in enumerate(attempts, 1):
+        response = client.generate(model=model, format=compact_schema(category_names, chars),
+                                   options=compact_options(chars),
+                                   **dict(request, prompt=f"{request['prompt']}\n\n{compact_response_format(chars)}"))
+        answer = parse_compact_response(response['response'], category_names)
+        if answer is not None:
+            return answer
+        logger.warning(f"Invalid answer from {model} (attempt {attempt} of {len(attempts)}): {response['response'][:200]!r}")
+
+    raise Exception(f"Error: no valid category from {model} after {len(attempts)} attempts")
+
+def add_compact_arguments(parser):
+    group = parser.add_argument_group("Compact output")
+    group.add_argument("--compact", action="store_true",
+                       help="Ask for a short JSON answer constrained to the category names, with a capped token budget")
+    group.add_argument("--explanation-chars", type=int, default=DEFAULT_EXPLANATION_CHARS,
+                       help=f"With --compact, maximum length of the explanation; 0 asks for the category only (default: {DEFAULT_EXPLANATION_CHARS})")
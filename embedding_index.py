@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # Only needed when k-NN categorization is enabled
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_K = 5
+DEFAULT_THRESHOLD = 0.9
+
+class EmbeddingIndex:
+    def __init__(self, path):
+        if np is None:
+            raise ImportError("k-NN categorization requires numpy (pip install numpy)")
+
+        self.path = path
+        self.vectors = None  # float32 matrix of unit-length rows
+        self.labels = []
+        self._added = []
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                self.vectors = data['vectors'].astype(np.float32)
+                self.labels = data['labels'].tolist()
+            logger.info(f"Loaded {len(self.labels)} labelled embeddings from {path}")
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _matrix(self):
+        # New vectors are appended to a list and only stacked when the index is next queried
+        if self._added:
+            added = np.vstack(self._added)
+            self.vectors = added if self.vectors is None else np.vstack([self.vectors, added])
+            self._added = []
+        return self.vectors
+
+    def add(self, vector, label):
+        with self._lock:
+            self._added.append(vector.reshape(1, -1))
+            self.labels.append(label)
+
+    def query(self, vector, k=DEFAULT_K):
+        # Similarity-weighted vote of the k nearest labelled vectors: (label, best similarity for that label)
+        with self._lock:
+            matrix = self._matrix()
+            if matrix is None or matrix.shape[1] != vector.shape[0]:
+                return None, 0.0
+
+            similarities = matrix @ vector
+            nearest = np.argsort(similarities)[::-1][:k]
+            votes = defaultdict(float)
+            best = defaultdict(float)
+            for i in nearest:
+                label = self.labels[i]
+                votes[label] += similarities[i]
+                best[label] = max(best[label], float(similarities[i]))
+
+        label = max(votes, key=votes.get)
+        return label, best[label]
+
+    def save(self):
+        with self._lock:
+            matrix = self._matrix()
+            if matrix is None:
+                return
+            # Stored as float16 to halve the file size; cosine similarity barely changes
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'wb') as f:
+                np.savez_compressed(f, vectors=matrix.astype(np.float16), labels=np.array(self.labels))
+            os.replace(temp_path, self.path)
+        logger.info(f"Saved {len(self.labels)} labelled embeddings to {self.path}")
+
+class NearestNeighbourCategorizer:
+    def __init__(self, client, index, category_names, embed_model=DEFAULT_EMBED_MODEL, k=DEFAULT_K,
+                 threshold=DEFAULT_THRESHOLD):
+        self.client = client
+        self.index = index
+        self.category_names = set(category_names)
+        self.embed_model = embed_model
+        self.k = k
+        self.threshold = threshold
+
+    def embed(self, description):
+        vector = np.asarray(self.client.embed(description, model=self.embed_model), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def classify(self, description):
+        # (category or None, similarity, embedding); None when the neighbours are not similar enough
+        try:
+            vector = self.embed(description)
+        except Exception as e:
+            logger.error(f"Error embedding transaction: {e}")
+            return None, 0.0, None
+
+        label, similarity = self.index.query(vector, self.k)
+        if label in self.category_names and similarity >= self.threshold:
+            return label, similarity, vector
+        return None, similarity, vector
+
+    def learn(self, vector, category):
+        if vector is not None and category in self.category_names:
+            self.index.add(vector, category)
+
+def categorize_with_neighbours(knn, transactions, categorize_misses, category_of, record=None):
+    # Descriptions close enough to already labelled ones take their neighbours' category, as (category, explanation).
+    # The other rows get the answers of categorize_misses(positions), whose categories the index then learns.
+    # Returns (results, positions of the rows that were not matched); without an index every row is a miss.
+    results = [None] * len(transactions)
+    vectors = [None] * len(transactions)
+    misses = []
+
+    for position, transaction in enumerate(transactions):
+        if knn is None:
+            misses.append(position)
+            continue
+
+        category, similarity, vectors[position] = knn.classify(transaction[2])
+        if category is not None:
+            logger.info(f"Categorized by nearest neighbours ({similarity:.2f} similarity): {transaction[2]} -> {category}")
+            if record is not None:
+                record('knn')
+            results[position] = category, f"Similar to previously labelled transactions ({similarity:.2f} similarity)"
+        else:
+            misses.append(position)
+
+    answers = categorize_misses(misses) if misses else []
+    for position, answer in zip(misses, answers):
+        results[position] = answer
+        if knn is not None:
+            knn.learn(vectors[position], category_of(answer))
+
+    return results, misses
+
+def knn_from_args(args, client, category_names):
+    if not args.knn_index:
+        return None
+    index = EmbeddingIndex(args.knn_index)
+    return NearestNeighbourCategorizer(client, index, category_names, embed_model=args.embed_model,
+                                       k=args.knn_k, threshold=args.knn_threshold)
+
+def add_knn_arguments(parser):
+    group = parser.add_argument_group("Nearest-neighbour categorization")
+    group.add_argument("--knn-index", help="Path to the .npz index of labelled embeddings; enables k-NN categorization")
+    group.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL, help=f"Ollama embedding model (default: {DEFAULT_EMBED_MODEL})")
+    group.add_argument("--knn-k", type=int, default=DEFAULT_K, help=f"Number of neighbours that vote (default: {DEFAULT_K})")
+    group.add_argument("--knn-threshold", type=float, default=DEFAULT_THRESHOLD,
+                       help=f"Minimum cosine similarity to accept a k-NN category (default: {DEFAULT_THRESHOLD})")
@@ -0,0 +1,108 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEALTH_INTERVAL = 30
+DEFAULT_EJECT_AFTER = 3
+
+def normalize_model(name):
+    # /api/tags lists "llava:latest" for a model requested as "llava"
+    return name if ':' in name else f"{name}:latest"
+
+class Endpoint:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.models = None  # Names from the last /api/tags, or None before the first check
+
+    def serves(self, model):
+        return model is None or self.models is None or normalize_model(model) in self.models
+
+class EndpointPool:
+    # Picks the healthy endpoint with the fewest requests in flight among those that list the model.
+    # An endpoint is ejected after eject_after consecutive failures and re-admitted once /api/tags answers again.
+    def __init__(self, base_urls, session, timeout, health_interval=DEFAULT_HEALTH_INTERVAL,
+                 eject_after=DEFAULT_EJECT_AFTER):
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.session = session
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._monitor = None
+
+        # A single endpoint has nowhere to fail over to, so it is used as-is without health checks
+        if len(self.endpoints) > 1:
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+            self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._monitor.start()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def check(self, endpoint):
+        try:
+            response = self.session.get(f"{endpoint.base_url}/api/tags", timeout=self.timeout)
+            response.raise_for_status()
+            models = {model['name'] for model in response.json()['models']}
+        except Exception as e:
+            with self._lock:
+                if endpoint.healthy:
+                    logger.warning(f"Ejecting Ollama endpoint {endpoint.base_url}: health check failed ({e})")
+                endpoint.healthy = False
+            return False
+
+        with self._lock:
+            if not endpoint.healthy:
+                logger.info(f"Re-admitting Ollama endpoint {endpoint.base_url}")
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.models = models
+        return True
+
+    def _monitor_loop(self):
+        # Refreshes the model lists and probes ejected endpoints so they can be re-admitted
+        while not self._stopped.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+
+    def serving(self, model=None):
+        with self._lock:
+            return [endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint.serves(model)]
+
+    def acquire(self, model=None):
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(model)] or self.endpoints
+            # With every candidate ejected, keep trying them rather than failing outright
+            candidates = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+
+            # Least outstanding requests, rotating the starting point so ties are spread evenly
+            self._next = (self._next + 1) % len(candidates)
+            rotated = candidates[self._next:] + candidates[:self._next]
+            endpoint = min(rotated, key=lambda candidate: candidate.outstanding)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, ok=True):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                return
+
+            endpoint.failures += 1
+            if len(self.endpoints) > 1 and endpoint.healthy and endpoint.failures >= self.eject_after:
+                endpoint.healthy = False
+                logger.warning(
+                    f"Ejecting Ollama endpoint {endpoint.base_url} after {endpoint.failures} consecutive failures; "
+                    f"re-checking every {self.health_interval}s"
+                )
+
+    def close(self):
+        self._stopped.set()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from categorization import transaction_direction
+from statement_reader import parse_amount, parse_statement_date, DEBIT_COLUMN, CREDIT_COLUMN
+
+logger = logging.getLogger(__name__)
+
+def transaction_fingerprint(transaction):
+    # The same transaction exported again carries the same date, reference, amount, direction and description;
+    # the balance is left out since it differs when an overlapping export starts from another row
+    txn_date, value_date, description, ref_no, debit, credit, balance = transaction[:7]
+    direction = transaction_direction(transaction)
+    raw_amount = transaction[DEBIT_COLUMN] if direction == "debit" else transaction[CREDIT_COLUMN]
+    amount = parse_amount(raw_amount)
+    key = [
+        txn_date.strip(),
+        ref_no.strip(),
+        f"{amount:.2f}" if amount is not None else raw_amount.strip(),
+        direction,
+        " ".join(description.upper().split()),
+    ]
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+class Ledger:
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.added = 0
+
+        # Statements processed in parallel share the connection, so every access goes through the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                fingerprint TEXT PRIMARY KEY,
+                txn_date TEXT NOT NULL,
+                description TEXT NOT NULL,
+                category TEXT NOT NULL,
+                response TEXT NOT NULL,
+                model TEXT,
+                statement TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS statements (
+                account TEXT NOT NULL,
+                statement TEXT NOT NULL,
+                start_date TEXT,
+                end_date TEXT,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (account, statement)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, transaction):
+        # The stored answer in "Category: ...\nExplanation: ..." form, or None for a transaction not seen before
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM transactions WHERE fingerprint = ?",
+                                     (transaction_fingerprint(transaction),)).fetchone()
+            if row is not None:
+                self.hits += 1
+        return row[0] if row else None
+
+    def put(self, transaction, category, response, model=None, statement=None):
+        # The first answer for a transaction is kept, so an overlapping export never changes an earlier category
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO transactions (fingerprint, txn_date, description, category, response, model, "
+                "statement, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (transaction_fingerprint(transaction), transaction[0], transaction[2], category, response, model,
+                 statement, time.time())
+            ).rowcount
+            self._conn.commit()
+            self.added += inserted
+
+    def record_statement(self, statement, account_details):
+        # Stores the statement's Start Date/End Date and logs how it fits with the account's earlier statements
+        account = account_details.get('Account Number') or account_details.get('Account Name') or ''
+        start = parse_statement_date(account_details.get('Start Date', ''))
+        end = parse_statement_date(account_details.get('End Date', ''))
+        if start is None or end is None:
+            logger.warning(f"{statement}: no readable Start Date/End Date, so its coverage is not checked")
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO statements (account, statement, start_date, end_date, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (account, statement, start.isoformat() if start else None, end.isoformat() if end else None, time.time())
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT statement, start_date, end_date FROM statements WHERE account = ? AND start_date IS NOT NULL "
+                "AND end_date IS NOT NULL ORDER BY start_date, end_date", (account,)
+            ).fetchall()
+
+        if start is not None and end is not None:
+            self.check_coverage(account, statement, start, end, rows)
+
+    def check_coverage(self, account, statement, start, end, rows):
+        periods = [(name, datetime.fromisoformat(first).date(), datetime.fromisoformat(last).date())
+                   for name, first, last in rows]
+        label = f"account {account}" if account else "the account"
+
+        for name, first, last in periods:
+            overlap_start, overlap_end = max(start, first), min(end, last)
+            if name != statement and overlap_start <= overlap_end:
+                days = (overlap_end - overlap_start).days + 1
+                logger.info(f"{statement} overlaps {name} on {days} days ({overlap_start} to {overlap_end}); "
+                            f"transactions already in the ledger are filled from it")
+
+        covered_until = None
+        for name, first, last in periods:
+            if covered_until is not None and first > covered_until + timedelta(days=1):
+                logger.warning(f"Coverage gap for {label}: no statement covers "
+                               f"{covered_until + timedelta(days=1)} to {first - timedelta(days=1)}")
+            covered_until = last if covered_until is None else max(covered_until, last)
+
+    def log_stats(self):
+        logger.info(f"Ledger: {self.hits} transactions filled from previous runs, {self.added} new transactions recorded")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def add_ledger_arguments(parser):
+    parser.add_argument("--ledger",
+                        help="Path to a SQLite ledger of categorized transactions; transactions seen in earlier runs "
+                             "are filled from it and only new ones go to the model")
+
+def ledger_from_args(args):
+    return Ledger(args.ledger) if args.ledger else None
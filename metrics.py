@@ -0,0 +1,241 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Ollama reports a few milliseconds of load_duration when the model is already resident
+COLD_LOAD_THRESHOLD_NS = 500_000_000
+
+SERVER_FIELDS = ('total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration', 'eval_count', 'eval_duration')
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(round(fraction * len(sorted_values), 9)) - 1, 0)  # Rounded so 0.95 * 60 is not 57.0000001
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class MetricsCollector:
+    def __init__(self, cold_load_threshold_ns=COLD_LOAD_THRESHOLD_NS):
+        self.cold_load_threshold_ns = cold_load_threshold_ns
+        self.calls = []
+        self.escalations = []  # (fast model, model, escalation reason or None, fast model seconds) per cascaded row
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record_call(self, kind, model, wall_time, response=None, error=None, system=None, prompt=None):
+        call = {"kind": kind, "model": model, "wall_time": wall_time, "error": error is not None,
+                "system_chars": len(system or ""), "prompt_chars": len(prompt or "")}
+        for field in SERVER_FIELDS:
+            call[field] = (response or {}).get(field) or 0
+        if response and response.get('time_to_first_token') is not None:
+            call['time_to_first_token'] = response['time_to_first_token']
+        with self._lock:
+            self.calls.append(call)
+
+    def record_cascade(self, fast_model, model, reason, seconds):
+        with self._lock:
+            self.escalations.append((fast_model, model, reason, seconds))
+
+    def add_rows(self, count):
+        with self._lock:
+            self.rows += count
+
+    def _summarize(self, calls):
+        latencies = sorted(call['wall_time'] for call in calls)
+        eval_tokens = sum(call['eval_count'] for call in calls)
+        eval_seconds = sum(call['eval_duration'] for call in calls) / 1e9
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call['error']),
+            "prompt_eval_tokens": sum(call['prompt_eval_count'] for call in calls),
+            "eval_tokens": eval_tokens,
+            "tokens_per_sec": eval_tokens / eval_seconds if eval_seconds else 0.0,
+            "load_seconds": sum(call['load_duration'] for call in calls) / 1e9,
+            "cold_loads": sum(1 for call in calls if call['load_duration'] > self.cold_load_threshold_ns),
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+            "model_seconds": sum(latencies),
+        }
+
+    def report(self):
+        with self._lock:
+            calls = list(self.calls)
+            escalations = list(self.escalations)
+            rows = self.rows
+        elapsed = time.perf_counter() - self.started
+
+        report = {
+            "rows": rows,
+            "elapsed_seconds": elapsed,
+            "rows_per_sec": rows / elapsed if elapsed else 0.0,
+        }
+        generate_calls = [call for call in calls if call['kind'] == 'generate']
+        report.update(self._summarize(generate_calls))
+
+        warmups = [call for call in calls if call['kind'] == 'warmup' and not call['error']]
+        if warmups:
+            report["warmup_load_seconds"] = sum(call['load_duration'] for call in warmups) / 1e9
+
+        # A warm-up with a system prompt evaluates little else, which tells us how many characters make a token.
+        # A later call that evaluated well under its system prompt plus its own prompt reused the server's cached prefix.
+        prefix = [call for call in warmups if call['system_chars'] and call['prompt_eval_count']]
+        if prefix:
+            chars_per_token = (sum(call['system_chars'] + call['prompt_chars'] for call in prefix) /
+                               sum(call['prompt_eval_count'] for call in prefix))
+            reused = [call for call in generate_calls if call['system_chars'] and not call['error']
+                      and call['prompt_eval_count'] < (call['system_chars'] / 2 + call['prompt_chars']) / chars_per_token]
+            report["system_prompt_tokens"] = round(prefix[0]['system_chars'] / chars_per_token)
+            report["prefix_reused_calls"] = len(reused)
+            report["prompt_eval_tokens_saved"] = round(sum(call['system_chars'] for call in reused) / chars_per_token)
+
+        if escalations:
+            report["cascade"] = self._summarize_cascade(escalations, generate_calls)
+
+        models = {}
+        for call in calls:
+            models.setdefault((call['kind'], call['model']), []).append(call)
+        report["models"] = [
+            dict(kind=kind, model=model, **self._summarize(model_calls))
+            for (kind, model), model_calls in sorted(models.items())
+        ]
+        return report
+
+    def _summarize_cascade(self, escalations, generate_calls):
+        fast_model, model = escalations[0][0], escalations[0][1]
+        escalated = [reason for _, _, reason, _ in escalations if reason is not None]
+        reasons = {}
+        for reason in escalated:
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+        # Without the cascade every row would have cost what an escalated row costs the main model;
+        # the fast model's time is spent on every row, including the ones it had to escalate
+        fast_seconds = sum(seconds for _, _, _, seconds in escalations)
+        model_seconds = sum(call['wall_time'] for call in generate_calls if call['model'] == model)
+        seconds_per_row = model_seconds / len(escalated) if escalated else None
+        accepted = len(escalations) - len(escalated)
+        return {
+            "fast_model": fast_model,
+            "model": model,
+            "transactions": len(escalations),
+            "escalated": len(escalated),
+            "escalation_rate": len(escalated) / len(escalations),
+            "reasons": reasons,
+            "fast_model_seconds": fast_seconds,
+            "model_seconds_per_row": seconds_per_row,
+            "seconds_saved": accepted * seconds_per_row - fast_seconds if seconds_per_row is not None else None,
+        }
+
+    def log_report(self, report=None):
+        report = report or self.report()
+        logger.info(
+            f"Performance: {report['rows']} rows in {report['elapsed_seconds']:.1f}s ({report['rows_per_sec']:.2f} rows/s), "
+            f"{report['calls']} generate calls, {report['tokens_per_sec']:.1f} tokens/s, "
+            f"latency p50/p95/p99 {report['latency_p50']:.2f}/{report['latency_p95']:.2f}/{report['latency_p99']:.2f}s, "
+            f"{report['cold_loads']} cold loads"
+        )
+        if 'warmup_load_seconds' in report:
+            logger.info(
+                f"Model load: {report['warmup_load_seconds']:.2f}s paid once at warm-up, "
+                f"{report['load_seconds']:.2f}s across {report['calls']} generate calls"
+            )
+        if 'prompt_eval_tokens_saved' in report:
+            logger.info(
+                f"System prompt: {report['system_prompt_tokens']} prefix tokens reused by "
+                f"{report['prefix_reused_calls']} of {report['calls']} calls, "
+                f"about {report['prompt_eval_tokens_saved']} prompt-eval tokens saved"
+            )
+        if 'cascade' in report:
+            cascade = report['cascade']
+            reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(cascade['reasons'].items()))
+            if cascade['seconds_saved'] is not None:
+                saved = (f"about {cascade['seconds_saved']:.1f}s of model time saved versus sending every row to "
+                         f"{cascade['model']} ({cascade['model_seconds_per_row']:.2f}s per row)")
+            else:
+                saved = f"time saved unknown since nothing was escalated to {cascade['model']}"
+            logger.info(
+                f"Cascade: {cascade['escalated']} of {cascade['transactions']} transactions escalated from "
+                f"{cascade['fast_model']} to {cascade['model']} ({cascade['escalation_rate']:.1%}"
+                f"{'; ' + reasons if reasons else ''}), {saved}"
+            )
+
+    def write_json(self, path, report=None):
+        report = report or self.report()
+        write_atomically(path, json.dumps(report, indent=2) + "\n")
+
+    def write_prometheus(self, path, report=None, job="localllm"):
+        report = report or self.report()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {job}_{name} {help_text}")
+            lines.append(f"# TYPE {job}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{job}_{name}{{{label_text}}} {value}" if label_text else f"{job}_{name} {value}")
+
+        metric("rows_total", "counter", "Transactions processed in the run", [({}, report['rows'])])
+        metric("run_seconds", "gauge", "Wall time of the run", [({}, report['elapsed_seconds'])])
+        metric("rows_per_second", "gauge", "Transactions processed per second", [({}, report['rows_per_sec'])])
+
+        models = report['models']
+        metric("requests_total", "counter", "Ollama requests",
+               [({"kind": m['kind'], "model": m['model']}, m['calls']) for m in models])
+        metric("request_errors_total", "counter", "Failed Ollama requests",
+               [({"kind": m['kind'], "model": m['model']}, m['errors']) for m in models])
+        metric("request_latency_seconds", "summary", "Ollama request wall time",
+               [({"kind": m['kind'], "model": m['model'], "quantile": q}, m[f'latency_p{int(float(q) * 100)}'])
+                for m in models for q in ("0.5", "0.95", "0.99")])
+        metric("prompt_eval_tokens_total", "counter", "Prompt tokens evaluated",
+               [({"model": m['model']}, m['prompt_eval_tokens']) for m in models if m['kind'] == 'generate'])
+        metric("eval_tokens_total", "counter", "Tokens generated",
+               [({"model": m['model']}, m['eval_tokens']) for m in models if m['kind'] == 'generate'])
+        metric("eval_tokens_per_second", "gauge", "Generation speed reported by the server",
+               [({"model": m['model']}, m['tokens_per_sec']) for m in models if m['kind'] == 'generate'])
+        metric("cold_loads_total", "counter", "Requests that had to load the model",
+               [({"model": m['model']}, m['cold_loads']) for m in models if m['kind'] == 'generate'])
+
+        if 'warmup_load_seconds' in report:
+            metric("warmup_load_seconds", "gauge", "Model load time paid at warm-up", [({}, report['warmup_load_seconds'])])
+        if 'prompt_eval_tokens_saved' in report:
+            metric("prompt_eval_tokens_saved_total", "counter", "Prompt tokens not re-evaluated thanks to the cached system prompt",
+                   [({}, report['prompt_eval_tokens_saved'])])
+        if 'cascade' in report:
+            cascade = report['cascade']
+            metric("cascade_transactions_total", "counter", "Transactions first sent to the fast model",
+                   [({"fast_model": cascade['fast_model']}, cascade['transactions'])])
+            metric("cascade_escalations_total", "counter", "Transactions escalated from the fast model to the main model",
+                   [({"reason": reason}, count) for reason, count in sorted(cascade['reasons'].items())])
+            if cascade['seconds_saved'] is not None:
+                metric("cascade_seconds_saved", "gauge", "Estimated model time saved by the cascade",
+                       [({}, cascade['seconds_saved'])])
+
+        write_atomically(path, "\n".join(lines) + "\n")
+
+def write_atomically(path, content):
+    # Readers such as the node_exporter textfile collector never see a half-written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def add_metrics_arguments(parser):
+    group = parser.add_argument_group("Performance report")
+    group.add_argument("--metrics-json", help="Write the run's performance report as JSON to this path")
+    group.add_argument("--metrics-prom", help="Write the run's performance report as a Prometheus textfile to this path")
+
+def write_reports(metrics, args):
+    report = metrics.report()
+    metrics.log_report(report)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json, report)
+        logger.info(f"Performance report saved as {args.metrics_json}")
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom, report)
+        logger.info(f"Prometheus metrics saved as {args.metrics_prom}")
@@ -0,0 +1,137 @@
+import glob
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_EXTENSIONS = ('.csv',)
+
+def expand_inputs(input_path, extensions=STATEMENT_EXTENSIONS):
+    # A single file, every statement in a directory, or a glob such as "statements/2024-*.csv"
+    if os.path.isdir(input_path):
+        files = [os.path.join(input_path, name) for name in os.listdir(input_path)
+                 if name.lower().endswith(extensions)]
+    elif glob.has_magic(input_path):
+        files = [path for path in glob.glob(input_path) if os.path.isfile(path)]
+    else:
+        files = [input_path]
+    return sorted(files)
+
+def output_names(input_files):
+    # Name each statement's output after its file name, or after its path below the inputs' common directory when
+    # a glob such as "*/statement.csv" matches several statements with the same file name
+    basenames = [os.path.basename(path) for path in input_files]
+    root = os.path.commonpath([os.path.abspath(path) for path in input_files]) if input_files else ''
+    names = {}
+    for path, basename in zip(input_files, basenames):
+        if basenames.count(basename) > 1:
+            basename = os.path.relpath(os.path.abspath(path), root).replace(os.sep, '_')
+        if basename in names.values():
+            raise ValueError(f"{path} would overwrite the output of another statement named {basename}")
+        names[path] = basename
+    return names
+
+def is_multi_input(input_path):
+    return os.path.isdir(input_path) or glob.has_magic(input_path)
+
+class BoundedExecutor:
+    # A thread pool whose submit() blocks while max_pending tasks are queued or running, so every
+    # statement feeding it shares one bounded queue of model requests instead of queueing without limit
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self._slots = threading.BoundedSemaphore(max(max_pending, workers, 1))
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+class FileProgress:
+    # Logs each statement's progress in steps of 10%, and the number of finished statements
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.finished = 0
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def start(self, input_file, total_rows):
+        with self._lock:
+            self._files[input_file] = [0, total_rows, 0]
+        logger.info(f"Started {input_file}: {total_rows} transactions")
+
+    def advance(self, input_file, count=1):
+        with self._lock:
+            progress = self._files[input_file]
+            progress[0] += count
+            done, total, logged_step = progress
+            step = done * 10 // total if total else 10
+            if step <= logged_step or step >= 10:
+                return
+            progress[2] = step
+        logger.info(f"{input_file}: {done}/{total} transactions ({step * 10}%)")
+
+    def finish(self, input_file, error=None):
+        with self._lock:
+            self.finished += 1
+            finished = self.finished
+            self._files.pop(input_file, None)
+        if error is not None:
+            logger.error(f"Failed {input_file} ({finished}/{self.total_files} statements): {error}")
+        else:
+            logger.info(f"Finished {input_file} ({finished}/{self.total_files} statements)")
+
+def run_statements(input_files, parse, process, parse_workers=None, parallel_files=1):
+    # Parse every statement in a process pool, then run process(input_file, parsed) for up to
+    # parallel_files statements at a time; all of them submit their model requests to the same queue
+    progress = FileProgress(len(input_files))
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=max(parallel_files, 1)) as file_pool:
+        parsed = {input_file: parse_pool.submit(parse, input_file) for input_file in input_files}
+
+        def run(input_file):
+            try:
+                process(input_file, parsed[input_file].result(), progress)
+            except Exception as e:
+                failed.append(input_file)
+                progress.finish(input_file, error=e)
+            else:
+                progress.finish(input_file)
+
+        try:
+            for future in [file_pool.submit(run, input_file) for input_file in input_files]:
+                future.result()
+        except KeyboardInterrupt:
+            logger.warning("Interrupted. Statements already started will finish; the rest are skipped")
+            file_pool.shutdown(wait=False, cancel_futures=True)
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    logger.info(f"Processed {len(input_files) - len(failed)} of {len(input_files)} statements")
+    return failed
+
+def add_multi_statement_arguments(parser):
+    group = parser.add_argument_group("Multiple statements",
+                                      "--input may also be a directory of .csv statements or a quoted glob pattern")
+    group.add_argument("--parse-workers", type=int, help="Processes used to parse statements (default: one per CPU)")
+    group.add_argument("--parallel-files", type=int,
+                       help="Statements processed at the same time (default: the number of workers)")
+    group.add_argument("--max-queued", type=int,
+                       help="Model requests queued across all statements before readers wait (default: 4 per worker)")
@@ -1,34 +1,370 @@
 import requests
 import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from endpoint_pool import EndpointPool, DEFAULT_HEALTH_INTERVAL, DEFAULT_EJECT_AFTER
+from adaptive_limit import add_limiter_arguments, limiter_from_args
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 300
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+# Ollama only loads the model for an empty prompt, so a warm-up that should evaluate the system prompt sends this
+WARM_UP_PROMPT = "Hello"
+
+def parse_keep_alive(value):
+    # Ollama takes a duration such as "30m", or a number of seconds where a negative number keeps the model loaded
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def resolve_base_url(base_url=None):
+    # Fall back to the same OLLAMA_HOST variable the Ollama CLI uses, which may omit the scheme
+    base_url = base_url or os.environ.get("OLLAMA_HOST") or DEFAULT_BASE_URL
+    if "://" not in base_url:
+        base_url = f"http://{base_url}"
+    return base_url.rstrip('/')
+
+def resolve_base_urls(base_url=None):
+    # Several Ollama hosts can be given as a comma-separated list, e.g. "gpu1:11434,gpu2:11434"
+    if isinstance(base_url, (list, tuple)):
+        return [resolve_base_url(url) for url in base_url]
+    base_url = base_url or os.environ.get("OLLAMA_HOST") or DEFAULT_BASE_URL
+    return [resolve_base_url(url.strip()) for url in base_url.split(',') if url.strip()]
+
+class GenerationStream:
+    def __init__(self, response, started, on_close=None):
+        self._response = response
+        self.started = started
+        self.tokens = []
+        self.error = None
+        self.metadata = None
+        self.time_to_first_token = None
+        self.finished = None
+        self._on_close = on_close
+
+    def __iter__(self):
+        # Ollama streams one JSON object per line; the last one has "done": true and carries the timings
+        try:
+            for line in self._response.iter_lines():
+                if not line:
+                    continue
+
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise Exception(f"Error: {chunk['error']}")
+
+                token = chunk.get('response', '')
+                if token:
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - self.started
+                    self.tokens.append(token)
+                    yield token
+
+                if chunk.get('done'):
+                    self.metadata = chunk
+                    break
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.close()
+
+    @property
+    def response(self):
+        return ''.join(self.tokens)
+
+    def result(self):
+        # Same shape as a non-streaming response, plus the time to first token in seconds
+        result = dict(self.metadata or {})
+        if self.metadata is None and self.tokens and self.finished is not None:
+            # Closed before the final chunk, so there are no server timings; Ollama streams one token per chunk
+            result['eval_count'] = len(self.tokens)
+            result['eval_duration'] = int((self.finished - self.started - self.time_to_first_token) * 1e9)
+        result['response'] = self.response
+        result['time_to_first_token'] = self.time_to_first_token
+        return result
+
+    def close(self):
+        self._response.close()
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(self)
 
 class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
+    def __init__(self, base_url=None, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 metrics=None, keep_alive=None, health_interval=DEFAULT_HEALTH_INTERVAL, eject_after=DEFAULT_EJECT_AFTER,
+                 limiter=None):
+        self.base_urls = resolve_base_urls(base_url)
+        self.base_url = self.base_urls[0]
+        self.metrics = metrics
+        self.limiter = limiter
+        self.keep_alive = parse_keep_alive(keep_alive)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # One keep-alive session shared by every thread, with enough pooled connections per host for all of them
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.endpoints = EndpointPool(self.base_urls, self.session, timeout=connect_timeout,
+                                      health_interval=health_interval, eject_after=eject_after)
+        self._tracked = threading.local()
+
+    def _request(self, method, path, model=None, endpoint=None, **kwargs):
+        # Each attempt goes to the least busy endpoint serving the model, unless a specific endpoint is given.
+        # Streaming responses keep their endpoint counted as busy until the response is closed.
+        for attempt in range(self.max_retries + 1):
+            target = endpoint or self.endpoints.acquire(model)
+            url = f"{target.base_url}{path}"
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code < 500:
+                    if endpoint is None:
+                        self._release_when_read(response, target, kwargs.get('stream', False))
+                    return response
+                error = Exception(f"Error: {response.status_code}, {response.text}")
+
+            if endpoint is None:
+                self.endpoints.release(target, ok=False)
+
+            if attempt == self.max_retries:
+                raise error
 
-    def generate(self, prompt, model="llama3.1:8b", stream=False):
-        url = f"{self.base_url}/api/generate"
-        
+            # Exponential backoff with full jitter so parallel workers don't retry in lockstep
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.warning(f"Request to {url} failed ({error}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _release_when_read(self, response, endpoint, stream):
+        if not stream:
+            self.endpoints.release(endpoint)
+            return
+
+        close = response.close
+        released = []
+
+        def close_and_release():
+            close()
+            if not released:
+                released.append(True)
+                self.endpoints.release(endpoint)
+
+        response.close = close_and_release
+
+    def generate(self, prompt, model="llama3.1:8b", stream=False, format=None, images=None, system=None, options=None):
         payload = {
             "model": model,
             "prompt": prompt,
             "stream": stream
         }
+        if format:
+            payload["format"] = format
+        if images:
+            payload["images"] = images
+        if system:
+            payload["system"] = system
+        if options:
+            payload["options"] = options
+        if self.keep_alive is not None:
+            # Every request resets the server's unload timer, so each one has to carry the run's keep_alive
+            payload["keep_alive"] = self.keep_alive
+
+        # With an adaptive limiter, wait for a free slot (or fail fast while its circuit breaker is open)
+        slot = self.limiter.acquire() if self.limiter is not None else None
+        started = time.perf_counter()
 
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
+        def finish(result=None, error=None):
+            if slot is not None:
+                self.limiter.release(slot, ok=error is None)
+            self._record("generate", model, started, result, error=error, system=system, prompt=prompt)
+
+        try:
+            response = self._request("POST", "/api/generate", model=model, json=payload, stream=stream)
+            if response.status_code != 200:
+                error = Exception(f"Error: {response.status_code}, {response.text}")
+                response.close()
+                raise error
+            if stream:
+                return GenerationStream(response, started, on_close=lambda finished: finish(finished.result(), finished.error))
+            result = response.json()
+        except Exception as e:
+            finish(error=e)
+            raise
+
+        finish(result)
+        return result
+
+    def warm_up(self, model, system=None):
+        # An empty prompt only loads the model; with a system prompt a one-token generation evaluates the shared
+        # prefix so the server caches it. Every endpoint that serves the model is warmed, since any of them may
+        # receive the run's requests.
+        prompt = WARM_UP_PROMPT if system else ""
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        if system:
+            payload["system"] = system
+            payload["options"] = {"num_predict": 1}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+        endpoints = self.endpoints.serving(model)
+        if not endpoints:
+            logger.warning(f"No healthy Ollama endpoint lists {model}")
+
+        for endpoint in endpoints:
+            started = time.perf_counter()
+            try:
+                response = self._request("POST", "/api/generate", endpoint=endpoint, json=payload)
+                if response.status_code != 200:
+                    raise Exception(f"Error: {response.status_code}, {response.text}")
+                result = response.json()
+            except Exception as e:
+                self._record("warmup", model, started, error=e, system=system, prompt=prompt)
+                raise
+
+            if result.get('done_reason') == "load":
+                # A load-only reply carries no timings, so the whole call is the load time
+                result['load_duration'] = int((time.perf_counter() - started) * 1e9)
+            self._record("warmup", model, started, result, system=system, prompt=prompt)
+            logger.info(
+                f"Loaded {model} on {endpoint.base_url} in {(result.get('load_duration') or 0) / 1e9:.2f}s "
+                f"(keep_alive: {self.keep_alive})"
+            )
+
+    def release(self, model):
+        # keep_alive 0 unloads the model as soon as this request finishes
+        for endpoint in self.endpoints.serving(model):
+            response = self._request("POST", "/api/generate", endpoint=endpoint,
+                                     json={"model": model, "prompt": "", "keep_alive": 0, "stream": False})
+            if response.status_code != 200:
+                raise Exception(f"Error: {response.status_code}, {response.text}")
+            logger.info(f"Released {model} on {endpoint.base_url}")
+
+    def embed(self, text, model="nomic-embed-text"):
+        started = time.perf_counter()
+        try:
+            response = self._request("POST", "/api/embeddings", model=model, json={"model": model, "prompt": text})
+            if response.status_code != 200:
+                raise Exception(f"Error: {response.status_code}, {response.text}")
+            embedding = response.json()['embedding']
+        except Exception as e:
+            self._record("embed", model, started, error=e)
+            raise
+
+        self._record("embed", model, started)
+        return embedding
+
+    def _record(self, kind, model, started, response=None, error=None, system=None, prompt=None):
+        wall_time = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.record_call(kind, model, wall_time, response, error, system, prompt)
+        calls = getattr(self._tracked, 'calls', None)
+        if calls is not None and kind == "generate":
+            calls.append((model, wall_time))
+
+    @contextmanager
+    def track_calls(self):
+        # Collects (model, wall time) for each generate call made by this thread inside the block
+        calls = []
+        previous = getattr(self._tracked, 'calls', None)
+        self._tracked.calls = calls
+        try:
+            yield calls
+        finally:
+            self._tracked.calls = previous
 
     def list_models(self):
-        url = f"{self.base_url}/api/tags"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            return response.json()['models']
-        else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
+        # The models of every healthy endpoint, each listed once
+        models = {}
+        for endpoint in self.endpoints.serving():
+            response = self._request("GET", "/api/tags", endpoint=endpoint)
+
+            if response.status_code == 200:
+                for model in response.json()['models']:
+                    models.setdefault(model['name'], model)
+            else:
+                raise Exception(f"Error: {response.status_code}, {response.text}")
+        return list(models.values())
+
+    def close(self):
+        self.endpoints.close()
+        self.session.close()
+
+def warm_up_model(client, model, system=None):
+    # A failed warm-up only means the first request pays the load time, so the run carries on
+    try:
+        client.warm_up(model, system=system)
+    except Exception as e:
+        logger.warning(f"Could not warm up {model}: {e}")
+
+def release_model(client, model):
+    try:
+        client.release(model)
+    except Exception as e:
+        logger.warning(f"Could not release {model}: {e}")
+
+def print_metadata(response):
+    print("\nMetadata:")
+    if response.get('time_to_first_token') is not None:
+        print(f"Time to first token: {response['time_to_first_token']:.3f} s")
+    print(f"Total duration: {response['total_duration']} ns")
+    print(f"Load duration: {response['load_duration']} ns")
+    print(f"Prompt eval count: {response['prompt_eval_count']}")
+    print(f"Prompt eval duration: {response['prompt_eval_duration']} ns")
+    print(f"Eval count: {response['eval_count']}")
+    print(f"Eval duration: {response['eval_duration']} ns")
+
+def add_client_arguments(parser):
+    group = parser.add_argument_group("Ollama connection")
+    group.add_argument("--ollama-url",
+                       help=f"Ollama base URL, or a comma-separated list of hosts to balance requests across (default: $OLLAMA_HOST or {DEFAULT_BASE_URL})")
+    group.add_argument("--pool-size", type=int, help=f"Maximum pooled HTTP connections (default: {DEFAULT_POOL_SIZE} or the number of workers)")
+    group.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT, help="Connection timeout in seconds")
+    group.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT, help="Read timeout in seconds")
+    group.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, help="Retries for 5xx responses and connection errors")
+    group.add_argument("--health-interval", type=float, default=DEFAULT_HEALTH_INTERVAL,
+                       help="Seconds between /api/tags health checks when several hosts are given")
+    group.add_argument("--eject-after", type=int, default=DEFAULT_EJECT_AFTER,
+                       help="Consecutive failed requests before a host stops receiving requests until its health check passes")
+    add_limiter_arguments(group)
+    group.add_argument("--keep-alive",
+                       help="Keep the model loaded for this long between requests (e.g. 30m, or -1 for the whole run); "
+                            "the model is loaded before the first transaction and released when the run ends")
+
+def client_from_args(args, workers=1, metrics=None):
+    return OllamaClient(
+        base_url=args.ollama_url,
+        pool_size=args.pool_size or max(workers, DEFAULT_POOL_SIZE),
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        max_retries=args.max_retries,
+        metrics=metrics,
+        keep_alive=args.keep_alive,
+        health_interval=args.health_interval,
+        eject_after=args.eject_after,
+        limiter=limiter_from_args(args, workers)
+    )
 
 # Example usage
 if __name__ == "__main__":
@@ -42,18 +378,14 @@ if __name__ == "__main__":
 
     # Generate text
     prompt = "Tell me a short story about a robot learning to paint."
-    
+
     try:
-        response = client.generate(prompt, model="llama3.1:8b")
+        stream = client.generate(prompt, model="llama3.1:8b", stream=True)
         print("\nGenerated response:")
-        print(response['response'])
-        
-        print("\nMetadata:")
-        print(f"Total duration: {response['total_duration']} ns")
-        print(f"Load duration: {response['load_duration']} ns")
-        print(f"Prompt eval count: {response['prompt_eval_count']}")
-        print(f"Prompt eval duration: {response['prompt_eval_duration']} ns")
-        print(f"Eval count: {response['eval_count']}")
-        print(f"Eval duration: {response['eval_duration']} ns")
+        for token in stream:
+            print(token, end="", flush=True)
+        print()
+
+        print_metadata(stream.result())
     except Exception as e:
         print(f"An error occurred: {e}")
\ No newline at end of file
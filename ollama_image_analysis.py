@@ -1,42 +1,110 @@
-import requests
 import json
 import argparse
+import glob
 import os
+import io
 import base64
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ollama_client import add_client_arguments, client_from_args, print_metadata, warm_up_model, release_model
+from multi_statement import is_multi_input
+from response_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE_DAYS
 
-class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
-
-    def generate(self, prompt, model="llava", image_path=None):
-        url = f"{self.base_url}/api/generate"
-        
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False
-        }
-
-        if image_path:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            payload["images"] = [image_data]
-
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
-
-    def list_models(self):
-        url = f"{self.base_url}/api/tags"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            return response.json()['models']
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+DEFAULT_MAX_DIM = 1024
+DEFAULT_OUTPUT = "image_analysis.jsonl"
+
+def read_image(image_path):
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+def downscale_image(data, max_dim):
+    # Vision models work on a few hundred pixels per side, so a full-size phone photo only slows prompt evaluation
+    if not max_dim or Image is None:
+        return data
+
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_dim:
+            return data
+
+        image = ImageOps.exif_transpose(image)  # Phones store the rotation in EXIF, which re-encoding would drop
+        image.thumbnail((max_dim, max_dim))
+        output = io.BytesIO()
+        if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+            image.save(output, format='PNG', optimize=True)
         else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
+            image.convert('RGB').save(output, format='JPEG', quality=85)
+        return output.getvalue()
+
+def cache_prompt(data, prompt, max_dim):
+    # Key on the original content rather than the path, so renamed or copied images are still cache hits
+    return f"image sha256:{hashlib.sha256(data).hexdigest()} max_dim:{max_dim or 0}\n{prompt}"
+
+def analyze_image(client, model, image_path, prompt, max_dim=DEFAULT_MAX_DIM, cache=None, on_token=None):
+    # Returns the analysis text and the generate response (None when the answer came from the cache)
+    data = read_image(image_path)
+    key = cache_prompt(data, prompt, max_dim)
+
+    if cache is not None:
+        cached_response = cache.get(model, key)
+        if cached_response is not None:
+            logger.info(f"Using cached analysis for: {image_path}")
+            return cached_response, None
+
+    images = [base64.b64encode(downscale_image(data, max_dim)).decode('utf-8')]
+    if on_token is not None:
+        stream = client.generate(prompt, model=model, images=images, stream=True)
+        for token in stream:
+            on_token(token)
+        response = stream.result()
+    else:
+        response = client.generate(prompt, model=model, images=images)
+
+    if cache is not None:
+        cache.put(model, key, response['response'])
+    return response['response'], response
+
+def find_images(image_path):
+    if os.path.isdir(image_path):
+        paths = [os.path.join(image_path, name) for name in os.listdir(image_path)]
+    else:
+        paths = glob.glob(image_path)
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+
+def analyze_images(client, model, image_paths, prompt, output_file, workers=1, max_dim=DEFAULT_MAX_DIM, cache=None):
+    def analyze(image_path):
+        record = {"image": image_path, "model": model, "prompt": prompt}
+        try:
+            record["response"], response = analyze_image(client, model, image_path, prompt, max_dim=max_dim, cache=cache)
+            record["cached"] = response is None
+            if response is not None:
+                record["prompt_eval_count"] = response.get('prompt_eval_count')
+                record["eval_count"] = response.get('eval_count')
+                record["total_duration"] = response.get('total_duration')
+        except Exception as e:
+            logger.error(f"Error analyzing {image_path}: {e}")
+            record["error"] = str(e)
+        return record
+
+    errors = 0
+    with open(output_file, 'w', encoding='utf-8') as f, ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # map() yields in input order, so the JSONL lines follow the sorted file names
+        for count, record in enumerate(executor.map(analyze, image_paths), 1):
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            errors += 'error' in record
+            logger.info(f"[{count}/{len(image_paths)}] {record['image']}")
+
+    logger.info(f"Analyzed {len(image_paths) - errors} of {len(image_paths)} images. Results saved to {output_file}")
 
 def save_to_file(content, filename="output.txt"):
     with open(filename, "w") as f:
@@ -46,44 +114,77 @@ def save_to_file(content, filename="output.txt"):
 def main():
     parser = argparse.ArgumentParser(description="Analyze images using Ollama API")
     parser.add_argument("--model", default="llava", help="Model to use for analysis (default: llava)")
-    parser.add_argument("--image", required=True, help="Path to the image file to analyze")
+    parser.add_argument("--image", required=True, help="Path to the image file to analyze, a directory of images or a glob pattern")
     parser.add_argument("--prompt", default="Describe this image in detail.", help="Prompt for image analysis")
-    parser.add_argument("--output", help="Output file to save the analysis results")
+    parser.add_argument("--output",
+                        help=f"Output file to save the analysis results (JSONL for several images, default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--workers", type=int, default=1, help="Number of images to analyze in parallel (default: 1)")
+    parser.add_argument("--max-dim", type=int, default=DEFAULT_MAX_DIM,
+                        help=f"Downscale images so neither side exceeds this many pixels before upload; 0 sends the original (default: {DEFAULT_MAX_DIM})")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help=f"Path to the SQLite response cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Maximum number of cached responses to keep")
+    parser.add_argument("--cache-max-age-days", type=int, default=DEFAULT_MAX_AGE_DAYS, help="Discard cached responses older than this many days")
+    parser.add_argument("--list-models", action="store_true", help="List the models available on the Ollama server first")
+    add_client_arguments(parser)
     args = parser.parse_args()
 
-    client = OllamaClient()
+    client = client_from_args(args, workers=args.workers)
+
+    if args.list_models:
+        print("Available models:")
+        try:
+            models = client.list_models()
+            for model in models:
+                print(f"- {model['name']}")
+        except Exception as e:
+            print(f"Error listing models: {e}")
+            return
+
+    if args.max_dim and Image is None:
+        logger.warning("Pillow is not installed, so images are uploaded at full size (pip install pillow)")
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days)
 
-    print("Available models:")
-    try:
-        models = client.list_models()
-        for model in models:
-            print(f"- {model['name']}")
-    except Exception as e:
-        print(f"Error listing models: {e}")
-        return
-
-    if not os.path.exists(args.image):
-        print(f"Error: Image file '{args.image}' not found.")
-        return
-
-    print(f"\nAnalyzing image using {args.model}...")
     try:
-        response = client.generate(args.prompt, model=args.model, image_path=args.image)
-        print("\nAnalysis results:")
-        print(response['response'])
-        
-        if args.output:
-            save_to_file(response['response'], args.output)
-        
-        print("\nMetadata:")
-        print(f"Total duration: {response['total_duration']} ns")
-        print(f"Load duration: {response['load_duration']} ns")
-        print(f"Prompt eval count: {response['prompt_eval_count']}")
-        print(f"Prompt eval duration: {response['prompt_eval_duration']} ns")
-        print(f"Eval count: {response['eval_count']}")
-        print(f"Eval duration: {response['eval_duration']} ns")
-    except Exception as e:
-        print(f"An error occurred during analysis: {e}")
+        if args.keep_alive is not None:
+            warm_up_model(client, args.model)
+
+        if is_multi_input(args.image):
+            image_paths = find_images(args.image)
+            logger.info(f"Analyzing {len(image_paths)} images using {args.model}")
+            analyze_images(client, args.model, image_paths, args.prompt, args.output or DEFAULT_OUTPUT,
+                           workers=args.workers, max_dim=args.max_dim, cache=cache)
+            return
+
+        if not os.path.exists(args.image):
+            print(f"Error: Image file '{args.image}' not found.")
+            return
+
+        print(f"\nAnalyzing image using {args.model}...")
+        try:
+            print("\nAnalysis results:")
+            analysis, response = analyze_image(client, args.model, args.image, args.prompt, max_dim=args.max_dim,
+                                               cache=cache, on_token=lambda token: print(token, end="", flush=True))
+            if response is None:
+                print(analysis, end="")
+            print()
+
+            if args.output:
+                save_to_file(analysis, args.output)
+
+            if response is not None:
+                print_metadata(response)
+        except Exception as e:
+            print(f"An error occurred during analysis: {e}")
+    finally:
+        if args.keep_alive is not None:
+            release_model(client, args.model)
+        client.close()
+        if cache is not None:
+            cache.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,74 +1,86 @@
-import csv
 import xlsxwriter
 import os
 import logging
 from datetime import datetime
 import argparse
-import requests
+from functools import partial
+from ollama_client import OllamaClient, add_client_arguments, client_from_args, warm_up_model, release_model
+from categorization import load_category_keywords, format_response, match_category, batch_system_prompt, categorize_in_batch, read_until_complete, group_key, add_compact_arguments, generate_compact
+from statement_reader import iter_statement_rows, parse_account_detail, parse_amount, HEADER, AMOUNT_COLUMNS, DEBIT_COLUMN, CREDIT_COLUMN
+from progress_journal import ProgressJournal, DEFAULT_FSYNC_EVERY, fingerprint
+from embedding_index import add_knn_arguments, categorize_with_neighbours, knn_from_args
+from pdf_statement import is_pdf, parse_pdf_statement
+from ledger import add_ledger_arguments, ledger_from_args
+from transaction_store import account_name, add_store_arguments, call_summary, store_from_args
+from cascade import add_cascade_arguments, cascade_from_args
+from metrics import MetricsCollector, add_metrics_arguments, write_reports
+from multi_statement import BoundedExecutor, add_multi_statement_arguments, expand_inputs, is_multi_input, output_names, run_statements
+from response_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE_DAYS
+
+# How often the adaptive concurrency limit and queue depth are logged, in transactions categorized
+STATUS_EVERY = 100
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
-
-    def generate(self, prompt, model="llama3.1:8b", stream=False):
-        url = f"{self.base_url}/api/generate"
-        
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": stream
-        }
-
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
-
-def parse_bank_statement(file_path):
+def parse_bank_statement(file_path, page_cache=None, page_workers=None):
     logger.info(f"Starting to parse bank statement from file: {file_path}")
-    
+
+    if is_pdf(file_path):
+        account_details, transactions = parse_pdf_statement(file_path, page_cache, page_workers)
+        return account_details, iter_transactions((None, row) for row in transactions)
+
+    # The account details are read up front; transactions are read lazily from the same pass over the file
+    rows = iter_statement_rows(file_path)
     account_details = {}
-    transactions = []
-    transaction_start_row = None
-    
-    with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        for row_index, row in enumerate(reader):
-            if row and row[0] == 'Txn Date':
-                transaction_start_row = row_index
-                break
-            elif row and ':' in row[0]:
-                key, value = row[0].split(':', 1)
-                account_details[key.strip()] = row[1].strip() if len(row) > 1 else ''
-                logger.debug(f"Extracted account detail: {key.strip()} = {account_details[key.strip()]}")
-    
-    if transaction_start_row is None:
-        logger.error("Could not find transaction data in the file")
-        raise ValueError("Could not find transaction data in the file")
-    
-    # Extract transactions
-    with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        for row_index, row in enumerate(reader):
-            if row_index > transaction_start_row:
-                if row and row[0]:  # Ensure it's not an empty row
-                    transaction = [cell.strip() for cell in row[:7]]  # Take first 7 columns and strip whitespace
-                    transactions.append(transaction)
-                    logger.debug(f"Parsed transaction: {transaction}")
-    
-    logger.info(f"Parsed {len(transactions)} transactions")
-    return account_details, transactions
-
-def categorize_transaction(client, model, transaction):
+    for kind, row in rows:
+        if kind == HEADER:
+            break
+        detail = parse_account_detail(row)
+        if detail:
+            key, value = detail
+            account_details[key] = value
+            logger.debug(f"Extracted account detail: {key} = {value}")
+
+    return account_details, iter_transactions(rows)
+
+def iter_transactions(rows):
+    count = 0
+    for kind, row in rows:
+        if row and row[0]:  # Ensure it's not an empty row
+            transaction = [cell.strip() for cell in row[:7]]  # Take first 7 columns and strip whitespace
+            logger.debug(f"Parsed transaction: {transaction}")
+            count += 1
+            yield transaction
+
+    logger.info(f"Parsed {count} transactions")
+
+def load_bank_statement(file_path, page_cache=None, page_workers=1):
+    # Used by the parse processes when several statements are processed together; each of them already
+    # runs in its own process, so PDF pages are extracted one after another
+    account_details, transactions = parse_bank_statement(file_path, page_cache, page_workers)
+    return account_details, list(transactions)
+
+CATEGORIES = [
+    "Income",
+    "Housing",
+    "Transportation",
+    "Food",
+    "Utilities",
+    "Insurance",
+    "Medical & Healthcare",
+    "Savings & Investments",
+    "Personal Spending",
+    "Recreation & Entertainment",
+    "Miscellaneous",
+]
+
+def build_prompt(transaction, category_names=CATEGORIES):
     txn_date, value_date, description, ref_no, debit, credit, balance = transaction
+    category_list = "\n".join(f"{number}. {name}" for number, name in enumerate(category_names, 1))
 
-    prompt = f"""As an AI financial assistant, categorize the following bank transaction and provide a brief explanation:
+    return f"""As an AI financial assistant, categorize the following bank transaction and provide a brief explanation:
 
 Transaction Date: {txn_date}
 Description: {description}
@@ -76,17 +88,7 @@ Debit: {debit}
 Credit: {credit}
 
 Please categorize this transaction into one of the following categories:
-1. Income
-2. Housing
-3. Transportation
-4. Food
-5. Utilities
-6. Insurance
-7. Medical & Healthcare
-8. Savings & Investments
-9. Personal Spending
-10. Recreation & Entertainment
-11. Miscellaneous
+{category_list}
 
 Provide your response in the following format:
 Category: [category number]
@@ -94,28 +96,89 @@ Explanation: [brief explanation]
 
 """
 
-    logger.info(f"Sending transaction to model for categorization: {description}")
-    try:
-        response = client.generate(prompt, model=model)
-        category_response = response['response'].strip()
+def build_system_prompt(category_names=CATEGORIES):
+    # Everything in build_prompt() that is the same for every transaction, so the server can reuse it as a cached prefix
+    category_list = "\n".join(f"{number}. {name}" for number, name in enumerate(category_names, 1))
+
+    return f"""As an AI financial assistant, categorize the bank transaction you are given and provide a brief explanation.
+
+Please categorize the transaction into one of the following categories:
+{category_list}
+
+Provide your response in the following format:
+Category: [category number]
+Explanation: [brief explanation]
+"""
+
+def build_transaction_block(transaction):
+    return f"Transaction Date: {transaction[0]}\nDescription: {transaction[2]}\nDebit: {transaction[4]}\nCredit: {transaction[5]}"
+
+def build_batch_instructions(category_names=CATEGORIES):
+    return (
+        "As an AI financial assistant, categorize each of the following bank transactions into one of these "
+        f"categories and provide a brief explanation: {', '.join(category_names)}"
+    )
 
-        # Split the response into lines and remove any empty lines
-        category_lines = [line.strip() for line in category_response.split('\n') if line.strip()]
+def parse_category_response(category_response, category_names=CATEGORIES):
+    # Split the response into lines and remove any empty lines
+    category_lines = [line.strip() for line in category_response.split('\n') if line.strip()]
 
-        # Initialize category and explanation
-        category = "Uncategorized"
-        explanation = "No explanation provided"
+    # Initialize category and explanation
+    category = "Uncategorized"
+    explanation = "No explanation provided"
 
-        # Try to extract category and explanation
-        for line in category_lines:
-            if line.lower().startswith("category:"):
-                category = line.split(":", 1)[1].strip()
-            elif line.lower().startswith("explanation:"):
-                explanation = line.split(":", 1)[1].strip()
+    # Try to extract category and explanation
+    for line in category_lines:
+        if line.lower().startswith("category:"):
+            category = line.split(":", 1)[1].strip()
+            category = match_category(category, category_names) or category
+        elif line.lower().startswith("explanation:"):
+            explanation = line.split(":", 1)[1].strip()
 
-        # If we didn't find a category or explanation, use the whole response
-        if category == "Uncategorized" and explanation == "No explanation provided":
-            explanation = category_response
+    # If we didn't find a category or explanation, use the whole response
+    if category == "Uncategorized" and explanation == "No explanation provided":
+        explanation = category_response
+
+    return category, explanation
+
+def build_request(transaction, category_names=CATEGORIES, system_prompt=False):
+    if system_prompt:
+        return dict(prompt=build_transaction_block(transaction), system=build_system_prompt(category_names))
+    return dict(prompt=build_prompt(transaction, category_names))
+
+def categorize_transaction(client, model, transaction, cache=None, stream=False, category_names=CATEGORIES,
+                           system_prompt=False, cascade=None, compact=None):
+    description = transaction[2]
+    prompt = build_prompt(transaction, category_names)
+
+    # The full prompt stays the cache key, so answers are shared with and without the system prompt
+    request = build_request(transaction, category_names, system_prompt)
+
+    cached_response = cache.get(model, prompt) if cache is not None else None
+
+    try:
+        if cached_response is not None:
+            logger.info(f"Using cached categorization for: {description}")
+            category_response = cached_response
+        else:
+            if cascade is not None:
+                answer = cascade.categorize(client, model, transaction, request, cache=cache, cache_prompt=prompt)
+                if answer is not None:
+                    return answer
+
+            logger.info(f"Sending transaction to model for categorization: {description}")
+            if compact is not None:
+                # compact is the explanation length in characters, or 0 for the category alone
+                category_response = format_response(*generate_compact(client, model, request, category_names, compact))
+            elif stream:
+                category_response = read_until_complete(client.generate(model=model, stream=True, **request)).strip()
+            else:
+                response = client.generate(model=model, **request)
+                category_response = response['response'].strip()
+            if cache is not None:
+                cache.put(model, prompt, category_response)
+
+        category, explanation = parse_category_response(category_response, category_names)
 
         logger.info(f"Categorized transaction: Category = {category}, Explanation = {explanation}")
         return category, explanation
@@ -124,21 +187,62 @@ Explanation: [brief explanation]
         logger.error(f"Error categorizing transaction: {e}")
         return "Error", f"Failed to categorize: {str(e)}"
 
-def process_file(input_file, output_folder, model):
-    client = OllamaClient()
+def categorize_batch(client, model, transactions, cache=None, stream=False, category_names=CATEGORIES,
+                     system_prompt=False, cascade=None, compact=None):
+    rows = [(transaction, build_prompt(transaction, category_names), build_request(transaction, category_names, system_prompt),
+             build_transaction_block(transaction)) for transaction in transactions]
 
-    logger.info(f"Processing file: {input_file}")
-    try:
-        account_details, transactions = parse_bank_statement(input_file)
-    except Exception as e:
-        logger.error(f"Error parsing file: {e}")
-        return
+    def fallback(transaction):
+        return format_response(*categorize_transaction(client, model, transaction, None, stream, category_names,
+                                                       system_prompt, compact=compact))
 
-    start_date = account_details.get('Start Date', 'Unknown')
-    end_date = account_details.get('End Date', 'Unknown')
-    output_file = os.path.join(output_folder, f"processed_statement_{start_date}_{end_date}.xlsx")
-    workbook = xlsxwriter.Workbook(output_file)
+    answers = categorize_in_batch(client, model, rows, category_names, build_batch_instructions(category_names),
+                                  fallback, cache=cache, system_prompt=system_prompt, cascade=cascade, compact=compact)
+    return [parse_category_response(answer, category_names) for answer in answers]
+
+def categorize_into_journal(client, model, batch, journal, cache=None, stream=False, category_names=CATEGORIES,
+                            knn=None, system_prompt=False, cascade=None, compact=None):
+    if not batch:
+        return []
+
+    def categorize_misses(misses):
+        try:
+            if len(misses) > 1:
+                return categorize_batch(client, model, [batch[i][1] for i in misses], cache, stream, category_names,
+                                        system_prompt, cascade, compact)
+            logger.info(f"Processing transaction: {batch[misses[0]][1][2]}")  # Log description
+            return [categorize_transaction(client, model, batch[misses[0]][1], cache, stream, category_names,
+                                           system_prompt, cascade, compact)]
+        except Exception as e:
+            logger.error(f"Error processing transaction: {e}")
+            return [("Error", f"Failed to process: {str(e)}")] * len(misses)
+
+    with client.track_calls() as calls:
+        results, misses = categorize_with_neighbours(knn, [transaction for _, transaction in batch], categorize_misses,
+                                                     lambda answer: answer[0])
+
+    # The model and its share of the request time, for the rows that went to the model
+    row_calls = [(None, None)] * len(batch)
+    for position in misses:
+        row_calls[position] = call_summary(calls, len(misses))
+
+    for (index, transaction), (category, explanation), (call_model, latency) in zip(batch, results, row_calls):
+        journal.append(index, transaction, category, explanation, call_model, latency)
+    return results
+
+def output_path(output_folder, start_date, end_date, statement_name=None):
+    # Statements of several accounts can cover the same dates, so multi-statement runs include the input name
+    name = f"processed_statement_{statement_name}_{start_date}_{end_date}.xlsx" if statement_name else \
+        f"processed_statement_{start_date}_{end_date}.xlsx"
+    # Statement dates such as 01/03/2024 would otherwise be read as directories
+    name = name.replace('/', '-').replace('\\', '-')
+    return os.path.join(output_folder, name)
+
+def write_workbook(output_file, account_details, journal, large_output=False):
+    # constant_memory flushes each row to disk as soon as the next one starts, so rows must be written in order
+    workbook = xlsxwriter.Workbook(output_file, {'constant_memory': large_output})
     worksheet = workbook.add_worksheet()
+    amount_format = workbook.add_format({'num_format': '#,##0.00'})
 
     # Write account details
     row = 0
@@ -155,54 +259,297 @@ def process_file(input_file, output_folder, model):
         worksheet.write(row, col, header)
     row += 1
 
-    # Process each transaction individually
-    for transaction in transactions:
-        logger.info(f"Processing transaction: {transaction[2]}")  # Log description
-        try:
-            category, explanation = categorize_transaction(client, model, transaction)
-        except Exception as e:
-            logger.error(f"Error processing transaction: {e}")
-            category, explanation = "Error", f"Failed to process: {str(e)}"
-        
-        # Write the transaction data and the new categorization
+    # Per-category totals, accumulated while the rows are written
+    summary = {}
+
+    for record in journal.iter_records():
+        transaction = record['transaction']
+        category = record['category']
         try:
-            worksheet.write_row(row, 0, transaction + [category, explanation])
+            worksheet.write_row(row, 0, transaction + [category, record['explanation']])
+            amounts = {}
+            for col in AMOUNT_COLUMNS:
+                if col < len(transaction):
+                    amounts[col] = parse_amount(transaction[col])
+                    if amounts[col] is not None:
+                        worksheet.write_number(row, col, amounts[col], amount_format)
         except Exception as e:
             logger.error(f"Error writing to Excel: {e}")
             worksheet.write_row(row, 0, transaction + ["Error writing", str(e)])
-        
+            amounts = {}
         row += 1
-        
-        # Save the workbook after each transaction
+
+        totals = summary.setdefault(category, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += amounts.get(DEBIT_COLUMN) or 0.0
+        totals[2] += amounts.get(CREDIT_COLUMN) or 0.0
+
+    summary_sheet = workbook.add_worksheet('Summary')
+    summary_sheet.write_row(0, 0, ['Category', 'Transactions', 'Total Debit', 'Total Credit', 'Net'])
+    for summary_row, (category, (count, debit, credit)) in enumerate(sorted(summary.items()), 1):
+        summary_sheet.write(summary_row, 0, category)
+        summary_sheet.write_number(summary_row, 1, count)
+        summary_sheet.write_number(summary_row, 2, debit, amount_format)
+        summary_sheet.write_number(summary_row, 3, credit, amount_format)
+        summary_sheet.write_number(summary_row, 4, credit - debit, amount_format)
+
+    workbook.close()
+
+def process_file(input_file, output_folder, model, cache=None, batch_size=1, client=None, stream=False,
+                 resume=False, fsync_every=DEFAULT_FSYNC_EVERY, large_output=False, dedup=False,
+                 category_names=CATEGORIES, knn=None, metrics=None, system_prompt=False, parsed=None, executor=None,
+                 progress=None, cascade=None, compact=None, ledger=None, page_cache=None, page_workers=None,
+                 store=None, output_name=None):
+    client = client or OllamaClient()
+
+    logger.info(f"Processing file: {input_file}")
+    if parsed is not None:
+        account_details, transactions = parsed
+    else:
         try:
-            workbook.close()
-            workbook = xlsxwriter.Workbook(output_file)
-            worksheet = workbook.get_worksheet_by_name('Sheet1')
+            account_details, transactions = parse_bank_statement(input_file, page_cache, page_workers)
         except Exception as e:
-            logger.error(f"Error saving workbook: {e}")
-            # If we can't save, create a new workbook
-            output_file = os.path.join(output_folder, f"processed_statement_{start_date}_{end_date}_{row}.xlsx")
-            workbook = xlsxwriter.Workbook(output_file)
-            worksheet = workbook.add_worksheet()
+            logger.error(f"Error parsing file: {e}")
+            return
 
-    workbook.close()
+    start_date = account_details.get('Start Date', 'Unknown')
+    end_date = account_details.get('End Date', 'Unknown')
+    statement_name = os.path.splitext(output_name)[0] if output_name else None
+    output_file = output_path(output_folder, start_date, end_date, statement_name)
+    if ledger is not None:
+        ledger.record_statement(os.path.basename(input_file), account_details)
+
+    # Every categorized transaction is appended to the journal, and the workbook is built from it once at the end
+    journal = ProgressJournal(f"{output_file}.journal", fsync_every=fsync_every)
+    completed = journal.load_completed() if resume else {}
+
+    groups = {}  # (merchant key, direction) -> answer for the first transaction in the group
+    waiting = {}  # (merchant key, direction) -> repeats waiting for the first transaction's answer
+    deduplicated = 0
+    from_ledger = 0
+
+    def remember(transaction, result):
+        # Only answers naming a category go into the ledger, so errors are retried by the next run
+        if ledger is not None and result[0] in category_names:
+            ledger.put(transaction, result[0], format_response(*result), model, os.path.basename(input_file))
+
+    def categorize_pending(batch):
+        arguments = (client, model, batch, journal, cache, stream, category_names, knn, system_prompt, cascade,
+                     compact)
+        if executor is not None:
+            # Wait for a slot in the model-request queue shared with the other statements
+            results = executor.submit(categorize_into_journal, *arguments).result()
+        else:
+            results = categorize_into_journal(*arguments)
+        written = len(batch)
+        for (index, transaction), result in zip(batch, results):
+            remember(transaction, result)
+            if dedup:
+                key = group_key(transaction)
+                groups[key] = result
+                for member_index, member in waiting.pop(key, []):
+                    journal.append(member_index, member, *result)
+                    remember(member, result)
+                    written += 1
+        if progress is not None:
+            progress.advance(input_file, written)
+        if client.limiter is not None and batch and batch[-1][0] // STATUS_EVERY != (batch[0][0] - 1) // STATUS_EVERY:
+            logger.info(f"{input_file}: {batch[-1][0] + 1} transactions read; concurrency {client.limiter.status()}")
+
+    journal.open(resume=resume)
+    try:
+        # Process each transaction individually, or batch_size transactions per model request
+        batch_size = max(batch_size, 1)
+        batch = []
+        skipped = 0
+        for index, transaction in enumerate(transactions):
+            if completed.get(index) == fingerprint(transaction):
+                skipped += 1
+                if progress is not None:
+                    progress.advance(input_file)
+                continue
+            if metrics is not None:
+                metrics.add_rows(1)
+
+            if ledger is not None:
+                # Seen in an earlier, overlapping statement
+                known = ledger.get(transaction)
+                if known is not None:
+                    journal.append(index, transaction, *parse_category_response(known, category_names))
+                    from_ledger += 1
+                    if progress is not None:
+                        progress.advance(input_file)
+                    continue
+
+            if dedup:
+                # Same merchant and direction as an earlier row, so reuse its answer
+                key = group_key(transaction)
+                if key in groups:
+                    journal.append(index, transaction, *groups[key])
+                    deduplicated += 1
+                    if progress is not None:
+                        progress.advance(input_file)
+                    continue
+                if key in waiting:
+                    waiting[key].append((index, transaction))
+                    deduplicated += 1
+                    continue
+                waiting[key] = []
+
+            batch.append((index, transaction))
+            if len(batch) >= batch_size:
+                categorize_pending(batch)
+                batch = []
+
+        categorize_pending(batch)
+    except KeyboardInterrupt:
+        journal.close()
+        logger.warning(f"Interrupted. Progress saved to {journal.path}; re-run with --resume to continue")
+        raise
+    journal.close()
+
+    if resume:
+        logger.info(f"Resumed: skipped {skipped} transactions categorized by the previous run")
+    if ledger is not None:
+        logger.info(f"Filled {from_ledger} transactions from the ledger")
+    if dedup and groups:
+        categorized = len(groups) + deduplicated
+        logger.info(
+            f"Deduplicated {categorized} transactions into {len(groups)} merchant groups "
+            f"({categorized / len(groups):.1f}x fewer categorizations)"
+        )
+
+    write_workbook(output_file, account_details, journal, large_output=large_output)
+    if store is not None:
+        occurrences = {}
+        for record in journal.iter_records():
+            category = record['category'] if record['category'] in category_names else None
+            store.append(account_name(account_details), os.path.basename(input_file), record['transaction'], category,
+                         record.get('model'), record.get('latency'), sequence=record['index'], occurrences=occurrences)
+        store.flush()
+    journal.remove()
+
+    if cache is not None:
+        cache.log_stats()
     logger.info(f"Processing complete. File saved as {output_file}")
 
 def main():
     parser = argparse.ArgumentParser(description="Process bank statements using Ollama API")
-    parser.add_argument("--input", required=True, help="Path to the input file")
+    parser.add_argument("--input", required=True,
+                        help="Path to the CSV or PDF statement, a directory of statements or a glob pattern")
     parser.add_argument("--output", required=True, help="Path to the output folder")
     parser.add_argument("--model", default="llama3.1:8b", help="Model to use for categorization")
     parser.add_argument("--log", default="info", choices=["debug", "info", "warning", "error"], help="Logging level")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Number of transactions to send to the model in a single request (default: 1)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Model requests in flight across all statements when --input names several (default: 1)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help=f"Path to the SQLite response cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Maximum number of cached responses to keep")
+    parser.add_argument("--cache-max-age-days", type=int, default=DEFAULT_MAX_AGE_DAYS, help="Discard cached responses older than this many days")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Categorize each merchant and direction once and reuse the answer for repeated transactions")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream model responses and stop reading once the Category and Explanation lines are complete")
+    parser.add_argument("--system-prompt", action="store_true",
+                        help="Send the category list and answer format once as a fixed system prompt so Ollama can reuse its cached prefix")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip transactions already categorized by an interrupted run of the same statement")
+    parser.add_argument("--fsync-every", type=int, default=DEFAULT_FSYNC_EVERY,
+                        help=f"Flush the progress journal to disk every N transactions (default: {DEFAULT_FSYNC_EVERY})")
+    parser.add_argument("--large-output", action="store_true",
+                        help="Write the workbook row by row with constant memory (for very large statements)")
+    parser.add_argument("--categories", help="Path to the JSON file containing custom categories (optional)")
+    parser.add_argument("--page-workers", type=int,
+                        help="Processes used to extract the pages of a PDF statement (default: one per CPU)")
+    add_client_arguments(parser)
+    add_cascade_arguments(parser)
+    add_compact_arguments(parser)
+    add_ledger_arguments(parser)
+    add_store_arguments(parser)
+    add_knn_arguments(parser)
+    add_metrics_arguments(parser)
+    add_multi_statement_arguments(parser)
     args = parser.parse_args()
 
     # Set logging level
+    logging.getLogger().setLevel(getattr(logging, args.log.upper()))
     logger.setLevel(getattr(logging, args.log.upper()))
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
-    process_file(args.input, args.output, args.model)
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days)
+
+    category_names = list(load_category_keywords(args.categories).keys()) if args.categories else CATEGORIES
+
+    metrics = MetricsCollector()
+    client = client_from_args(args, workers=args.workers, metrics=metrics)
+    knn = knn_from_args(args, client, category_names)
+    cascade = cascade_from_args(args, category_names, metrics)
+    ledger = ledger_from_args(args)
+    store = store_from_args(args)
+    try:
+        if args.keep_alive is not None or args.system_prompt:
+            # Load the model, and evaluate the shared system prompt, before the first transaction
+            system = None
+            if args.system_prompt and args.batch_size > 1:
+                system = batch_system_prompt(build_batch_instructions(category_names))
+            elif args.system_prompt:
+                system = build_system_prompt(category_names)
+            warm_up_model(client, args.model, system=system)
+            if cascade is not None and args.keep_alive is not None:
+                warm_up_model(client, cascade.fast_model)
+        options = dict(cache=cache, batch_size=args.batch_size, client=client, stream=args.stream, resume=args.resume,
+                       fsync_every=args.fsync_every, large_output=args.large_output, dedup=args.dedup,
+                       category_names=category_names, knn=knn, metrics=metrics, system_prompt=args.system_prompt,
+                       cascade=cascade, compact=args.explanation_chars if args.compact else None,
+                       ledger=ledger, store=store)
+        # Extracted PDF pages are cached next to the model answers
+        page_cache = None if args.no_cache else args.cache
+
+        if is_multi_input(args.input):
+            input_files = expand_inputs(args.input, extensions=('.csv', '.pdf'))
+            names = output_names(input_files)
+            logger.info(f"Found {len(input_files)} statements in {args.input}")
+            max_queued = args.max_queued or max(args.workers, 1) * 4
+
+            with BoundedExecutor(args.workers, max_queued) as executor:
+                def process(input_file, parsed, progress):
+                    progress.start(input_file, len(parsed[1]))
+                    process_file(input_file, args.output, args.model, parsed=parsed, executor=executor,
+                                 progress=progress, output_name=names[input_file], **options)
+
+                run_statements(input_files, partial(load_bank_statement, page_cache=page_cache), process,
+                               parse_workers=args.parse_workers,
+                               parallel_files=args.parallel_files or max(args.workers, 1))
+        else:
+            process_file(args.input, args.output, args.model, page_cache=page_cache, page_workers=args.page_workers,
+                         **options)
+        if client.limiter is not None:
+            client.limiter.log_summary()
+        write_reports(metrics, args)
+    except KeyboardInterrupt:
+        raise SystemExit(130)
+    finally:
+        if knn is not None:
+            knn.index.save()
+        if args.keep_alive is not None:
+            release_model(client, args.model)
+            if cascade is not None:
+                release_model(client, cascade.fast_model)
+        client.close()
+        if cache is not None:
+            cache.close()
+        if ledger is not None:
+            ledger.log_stats()
+            ledger.close()
+        if store is not None:
+            store.close()
+            logger.info(f"Categorized transactions stored in {store.path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
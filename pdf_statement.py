@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from response_cache import ResponseCache
+from statement_reader import parse_statement_date, DEBIT_COLUMN, AMOUNT_COLUMNS
+
+try:
+    import pdfplumber
+except ImportError:  # Only needed for PDF statements
+    pdfplumber = None
+
+logger = logging.getLogger(__name__)
+
+# Part of the page cache key; bump it when a change to the extraction would give different rows
+EXTRACTOR_VERSION = 1
+
+# First word of each column header, in the order of the 7-column transaction shape
+HEADER_WORDS = ("Txn", "Value", "Description", "Ref", "Debit", "Credit", "Balance")
+AMOUNT = re.compile(r"^-?[\d,]+\.\d{2}(?:\s?(?:Cr|Dr))?$", re.IGNORECASE)
+DETAIL = re.compile(r"^([A-Za-z][A-Za-z ./]{1,40}?)\s*:\s*(.+)$")
+PERIOD = re.compile(r"(?:period|from)\s*:?\s*(\d{1,2}[ /-]\w{2,9}[ /-]\d{2,4})\s*(?:to|-)\s*(\d{1,2}[ /-]\w{2,9}[ /-]\d{2,4})",
+                    re.IGNORECASE)
+LINE_TOLERANCE = 3  # Points of vertical drift between words printed on the same line
+
+def is_pdf(file_path):
+    return file_path.lower().endswith('.pdf')
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def group_lines(words):
+    lines = []
+    for word in sorted(words, key=lambda word: (round(word['top']), word['x0'])):
+        if lines and abs(word['top'] - lines[-1][0]['top']) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda word: word['x0']) for line in lines]
+
+def find_layout(line):
+    # (x0, x1) of each column header on a "Txn Date  Value Date  Description ..." line, or None
+    texts = [word['text'] for word in line]
+    if not all(any(text.startswith(header) for text in texts) for header in HEADER_WORDS):
+        return None
+    layout = []
+    for header in HEADER_WORDS:
+        position = next(i for i, text in enumerate(texts) if text.startswith(header))
+        end = position + 1 if header in ("Description", "Debit", "Credit", "Balance") else position + 2
+        layout.append((line[position]['x0'], line[min(end, len(line)) - 1]['x1']))
+    return layout
+
+def column_for(word, layout):
+    if AMOUNT.match(word['text']) and word['x1'] > layout[DEBIT_COLUMN][0]:
+        # Amounts are usually right-aligned, so they can start left of their header; pick the nearest header
+        center = (word['x0'] + word['x1']) / 2
+        return min(AMOUNT_COLUMNS, key=lambda column: abs(center - (layout[column][0] + layout[column][1]) / 2))
+    column = 0
+    for candidate, (x0, x1) in enumerate(layout[:DEBIT_COLUMN]):
+        if word['x0'] >= x0 - LINE_TOLERANCE:
+            column = candidate
+    return column
+
+def parse_details(lines):
+    details = {}
+    for text in lines:
+        match = DETAIL.match(text)
+        if match:
+            details.setdefault(match.group(1).strip(), match.group(2).strip())
+        period = PERIOD.search(text)
+        if period:
+            details.setdefault('Start Date', period.group(1))
+            details.setdefault('End Date', period.group(2))
+    return details
+
+def rows_from_tables(tables):
+    transactions = []
+    for table in tables:
+        for row in table:
+            cells = [" ".join((cell or '').split()) for cell in row]
+            if len(cells) >= 7 and parse_statement_date(cells[0]) is not None:
+                transactions.append(cells[:7])
+    return transactions
+
+def rows_from_words(lines, layout):
+    transactions = []
+    for line in lines:
+        cells = [[] for _ in range(7)]
+        for word in line:
+            cells[column_for(word, layout)].append(word['text'])
+        cells = [" ".join(cell) for cell in cells]
+
+        if parse_statement_date(cells[0]) is not None:
+            transactions.append(cells)
+        elif transactions and cells[2] and not any(cells[column] for column in (0, 1) + AMOUNT_COLUMNS):
+            # A description (or reference) wrapped onto the next line
+            transactions[-1][2] = f"{transactions[-1][2]} {cells[2]}".strip()
+            transactions[-1][3] = f"{transactions[-1][3]}{cells[3]}"
+    return transactions
+
+def extract_page(file_path, page_number, layout=None):
+    # Runs in a worker process: the account details, transactions and column layout of one page.
+    # Ruled tables are read as tables; otherwise words are placed in columns under the header line,
+    # or under the layout of an earlier page for continuation pages that do not repeat the header.
+    with pdfplumber.open(file_path) as pdf:
+        page = pdf.pages[page_number - 1]
+        lines = group_lines(page.extract_words())
+        tables = page.extract_tables()
+
+    header_index = None
+    for index, line in enumerate(lines):
+        found = find_layout(line)
+        if found is not None:
+            header_index, layout = index, found
+            break
+
+    texts = [" ".join(word['text'] for word in line) for line in lines]
+    details = parse_details(texts[:header_index] if header_index is not None else texts) if page_number == 1 else {}
+
+    transactions = rows_from_tables(tables)
+    if not transactions and layout is not None:
+        body = lines[header_index + 1:] if header_index is not None else lines
+        transactions = rows_from_words(body, layout)
+
+    return {"details": details, "transactions": transactions, "layout": layout}
+
+class PageCache:
+    # Extracted pages in the response cache, keyed on the file's content and the page number
+    def __init__(self, path, digest):
+        # No limits of its own: the run's main cache connection applies --cache-max-entries and --cache-max-age-days
+        self.cache = ResponseCache(path, max_entries=0, max_age_days=0) if path else None
+        self.digest = digest
+        self.hits = 0
+
+    def get(self, page_number):
+        if self.cache is None:
+            return None
+        cached = self.cache.get(f"pdf-page-v{EXTRACTOR_VERSION}", f"{self.digest}:{page_number}")
+        if cached is None:
+            return None
+        self.hits += 1
+        return json.loads(cached)
+
+    def put(self, page_number, page):
+        if self.cache is not None:
+            self.cache.put(f"pdf-page-v{EXTRACTOR_VERSION}", f"{self.digest}:{page_number}", json.dumps(page))
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+def iter_pdf_pages(file_path, page_cache=None, page_workers=None):
+    # Yields each page's extraction in order. Page 1 is extracted first for the account details and column
+    # layout; the other pages are extracted in a process pool while the earlier pages are being categorized.
+    if pdfplumber is None:
+        raise ImportError("PDF statements require pdfplumber (pip install pdfplumber)")
+
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+    cache = PageCache(page_cache, file_digest(file_path))
+    pool = ProcessPoolExecutor(max_workers=page_workers) if page_workers != 1 and page_count > 1 else None
+
+    def extracted(page_number, page):
+        if isinstance(page, Future):
+            page = page.result()
+            cache.put(page_number, page)
+        logger.info(f"{file_path}: page {page_number}/{page_count}, {len(page['transactions'])} transactions")
+        return page
+
+    try:
+        first = cache.get(1)
+        if first is None:
+            first = extract_page(file_path, 1)
+            cache.put(1, first)
+
+        # The later pages only need page 1's layout, so they are submitted before page 1 is handed out
+        pages = {}
+        for page_number in range(2, page_count + 1):
+            pages[page_number] = cache.get(page_number)
+            if pages[page_number] is None and pool is not None:
+                pages[page_number] = pool.submit(extract_page, file_path, page_number, first['layout'])
+
+        yield extracted(1, first)
+
+        for page_number in range(2, page_count + 1):
+            page = pages.pop(page_number)
+            if page is None:
+                page = extract_page(file_path, page_number, first['layout'])
+                cache.put(page_number, page)
+            yield extracted(page_number, page)
+
+        if cache.hits:
+            logger.info(f"{file_path}: {cache.hits} of {page_count} pages read from the page cache")
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        cache.close()
+
+def parse_pdf_statement(file_path, page_cache=None, page_workers=None):
+    # (account details, lazy iterator of 7-column transactions), like parse_bank_statement for CSV statements
+    pages = iter_pdf_pages(file_path, page_cache, page_workers)
+    first = next(pages)
+    if not first['layout'] and not first['transactions']:
+        logger.warning(f"{file_path}: no 'Txn Date ... Balance' header or transaction table found on page 1")
+
+    def transactions():
+        yield from first['transactions']
+        for page in pages:
+            yield from page['transactions']
+
+    return first['details'], transactions()
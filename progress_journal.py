@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FSYNC_EVERY = 50
+
+def fingerprint(transaction):
+    return hashlib.sha1(json.dumps(transaction).encode('utf-8')).hexdigest()
+
+class ProgressJournal:
+    def __init__(self, path, fsync_every=DEFAULT_FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = max(fsync_every, 1)
+        self._file = None
+        self._unsynced = 0
+
+    def load_completed(self):
+        # Map of index -> transaction fingerprint for every row that was categorized successfully
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partially written last line behind
+                    logger.warning(f"Ignoring truncated record in {self.path}")
+                    continue
+                if record['category'] == "Error":
+                    completed.pop(record['index'], None)
+                else:
+                    completed[record['index']] = fingerprint(record['transaction'])
+
+        return completed
+
+    def open(self, resume=False):
+        if resume:
+            self.truncate_partial()
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+
+    def truncate_partial(self):
+        # Cut a crash's unterminated last line, so the next record does not get appended onto it
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            # Scan back from the end for the last complete line
+            while end > 0:
+                start = max(end - 4096, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                logger.warning(f"Discarding {size - end} bytes of a truncated record at the end of {self.path}")
+                f.truncate(end)
+
+    def append(self, index, transaction, category, explanation, model=None, latency=None):
+        # model and latency are left empty for answers that did not come from a model call
+        record = {"index": index, "transaction": transaction, "category": category, "explanation": explanation,
+                  "model": model, "latency": latency}
+        self._file.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self._file is None or not self._unsynced:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def iter_records(self):
+        # Later records for the same index (retried errors) win; only the offsets are held in memory
+        offsets = {}
+        with open(self.path, 'rb') as f:
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                try:
+                    offsets[json.loads(line)['index']] = offset
+                except ValueError:
+                    pass
+                offset = f.tell()
+
+            for index in sorted(offsets):
+                f.seek(offsets[index])
+                yield json.loads(f.readline())
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "ollama_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_AGE_DAYS = 90
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+
+        # The connection is shared by the worker threads, so every access goes through the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model, prompt):
+        return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt):
+        key = self.make_key(model, prompt)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, model, prompt, response):
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            )
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            removed = 0
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+
+            if self.max_entries:
+                # Drop the least recently used entries beyond the size limit
+                removed += self._conn.execute("""
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,)).rowcount
+
+            self._conn.commit()
+
+        if removed:
+            logger.info(f"Evicted {removed} entries from response cache {self.path}")
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        logger.info(f"Response cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)")
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,61 @@
+import csv
+import re
+from datetime import datetime
+
+PREAMBLE = "preamble"
+HEADER = "header"
+TRANSACTION = "transaction"
+OTHER = "other"
+
+def iter_statement_rows(file_path):
+    # Single pass over the statement: (kind, row) pairs, read lazily after the 'Txn Date' header
+    with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+
+        # The account details before the header are short, so hold them until we know this is a statement
+        preamble = []
+        for row in reader:
+            if row and row[0] == 'Txn Date':
+                break
+            preamble.append(row)
+        else:
+            raise ValueError("Could not find transaction data in the file")
+
+        for preamble_row in preamble:
+            yield PREAMBLE, preamble_row
+        yield HEADER, row
+
+        for row in reader:
+            yield (TRANSACTION if row and len(row) >= 7 else OTHER), row
+
+DEBIT_COLUMN = 4
+CREDIT_COLUMN = 5
+BALANCE_COLUMN = 6
+AMOUNT_COLUMNS = (DEBIT_COLUMN, CREDIT_COLUMN, BALANCE_COLUMN)
+
+def parse_amount(value):
+    # "1,234.56", "INR 1,234.56" or "1,234.56 Cr" -> 1234.56; "Dr" balances are negative; blanks and text -> None
+    cleaned = re.sub(r"[,\s]|INR|Rs\.?|\u20b9", "", str(value), flags=re.IGNORECASE)
+    sign = 1
+    if cleaned[-2:].lower() in ("cr", "dr"):
+        sign = -1 if cleaned[-2:].lower() == "dr" else 1
+        cleaned = cleaned[:-2]
+    if not re.fullmatch(r"-?\d+(\.\d+)?", cleaned):
+        return None
+    return sign * float(cleaned)
+
+def parse_account_detail(row):
+    if row and ':' in row[0]:
+        key, value = row[0].split(':', 1)
+        return key.strip(), row[1].strip() if len(row) > 1 else ''
+    return None
+
+STATEMENT_DATE_FORMATS = ("%d %b %Y", "%d %B %Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d-%b-%Y", "%d/%m/%y")
+
+def parse_statement_date(value):
+    for date_format in STATEMENT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except (ValueError, AttributeError):
+            continue
+    return None
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from categorization import transaction_direction
+from ledger import transaction_fingerprint
+from statement_reader import parse_amount, parse_statement_date, DEBIT_COLUMN, CREDIT_COLUMN, BALANCE_COLUMN
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the report
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_EVERY = 500
+
+def call_summary(calls, rows=1):
+    # (model, seconds per row) for the generate calls that answered a group of rows; (None, None) without any
+    if not calls:
+        return None, None
+    return calls[-1][0], sum(wall_time for _, wall_time in calls) / max(rows, 1)
+
+class TransactionStore:
+    # Typed, categorized transactions in an indexed SQLite table, one row per transaction across all statements.
+    # A transaction exported again in an overlapping statement replaces its earlier row instead of adding another;
+    # identical transactions within one statement (two equal payments on the same day) are told apart by how many
+    # times the fingerprint appeared before in that statement.
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = max(flush_every, 1)
+        self._pending = []
+        self._dates = {}  # Statements repeat the same few dates, and trying each date format is most of the cost
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                account TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                statement TEXT,
+                seq INTEGER,
+                txn_date TEXT,
+                month TEXT,
+                description TEXT NOT NULL,
+                ref_no TEXT,
+                direction TEXT NOT NULL,
+                amount REAL,
+                balance REAL,
+                category TEXT,
+                model TEXT,
+                latency REAL,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (account, fingerprint)
+            )
+        """)
+        if 'seq' not in [column[1] for column in self._conn.execute("PRAGMA table_info(transactions)")]:
+            self._conn.execute("ALTER TABLE transactions ADD COLUMN seq INTEGER")  # Stores from before it was recorded
+        # Covers the report's totals, so they are read from the index without touching the table
+        self._conn.execute("CREATE INDEX IF NOT EXISTS transactions_report "
+                           "ON transactions (account, month, category, direction, amount, txn_date)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS transactions_account_order ON transactions (account, txn_date, seq)")
+        self._conn.commit()
+
+    def append(self, account, statement, transaction, category, model=None, latency=None, sequence=None,
+               occurrences=None):
+        # sequence is the row's position in its statement, which orders transactions on the same date.
+        # occurrences is a dict the caller keeps for each statement, counting the fingerprints appended so far.
+        txn_date, value_date, description, ref_no, debit, credit, balance = transaction[:7]
+        direction = transaction_direction(transaction)
+        amount = parse_amount(transaction[DEBIT_COLUMN] if direction == "debit" else transaction[CREDIT_COLUMN])
+        if txn_date not in self._dates:
+            self._dates[txn_date] = parse_statement_date(txn_date)
+        parsed_date = self._dates[txn_date]
+        fingerprint = transaction_fingerprint(transaction)
+        if occurrences is not None:
+            occurrence = occurrences.get(fingerprint, 0)
+            occurrences[fingerprint] = occurrence + 1
+            if occurrence:
+                # The first occurrence keeps the plain fingerprint, so rows stored before this was counted still match
+                fingerprint = f"{fingerprint}#{occurrence}"
+        row = (
+            account or '', fingerprint, statement, sequence,
+            parsed_date.isoformat() if parsed_date else txn_date, parsed_date.strftime("%Y-%m") if parsed_date else None,
+            description, ref_no, direction, amount, parse_amount(transaction[BALANCE_COLUMN]),
+            category, model, latency, time.time(),
+        )
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        # Rows are written in batches, since a commit per transaction would dominate large statements
+        if self._pending:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO transactions (account, fingerprint, statement, seq, txn_date, month, description, "
+                "ref_no, direction, amount, balance, category, model, latency, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending
+            )
+            self._conn.commit()
+            self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+def account_name(account_details):
+    return account_details.get('Account Number') or account_details.get('Account Name') or ''
+
+def add_store_arguments(parser):
+    parser.add_argument("--store",
+                        help="Append the categorized transactions, with typed dates and amounts, to this SQLite "
+                             "store for `python transaction_store.py report`")
+
+def store_from_args(args):
+    return TransactionStore(args.store) if args.store else None
+
+def report_filter(account=None, start=None, end=None):
+    conditions, parameters = ["month IS NOT NULL"], []
+    if account:
+        conditions.append("account = ?")
+        parameters.append(account)
+    if start:
+        conditions.append("txn_date >= ?")
+        parameters.append(start)
+    if end:
+        conditions.append("txn_date <= ?")
+        parameters.append(end)
+    return " AND ".join(conditions), parameters
+
+def edge_transaction(conn, account, first_date, last_date, last=False):
+    # (balance, signed amount) of an account's first or last transaction between two ISO dates, in statement order
+    order = "DESC" if last else "ASC"
+    return conn.execute(
+        "SELECT balance, CASE direction WHEN 'debit' THEN -amount ELSE amount END FROM transactions "
+        "WHERE account = ? AND txn_date >= ? AND txn_date <= ? AND month IS NOT NULL "
+        f"ORDER BY txn_date {order}, seq {order} LIMIT 1", (account, first_date, last_date)
+    ).fetchone() or (None, None)
+
+def load_totals(conn, account=None, start=None, end=None):
+    # Totals are aggregated in SQLite over a covering index, so one row per account, month and category reaches
+    # Python; the statement balances come from single-row lookups on the (account, txn_date, seq) index
+    where, parameters = report_filter(account, start, end)
+    groups = conn.execute(
+        "SELECT account, month, COALESCE(category, 'Uncategorized'), TOTAL(CASE direction WHEN 'debit' THEN amount END), "
+        "TOTAL(CASE direction WHEN 'debit' THEN NULL ELSE amount END), COUNT(*) "
+        f"FROM transactions WHERE {where} GROUP BY account, month, category", parameters
+    ).fetchall()
+
+    first_date, last_date = start or "0000-00-00", end or "9999-99-99"
+    closing, opening = {}, {}
+    for account, month in sorted({(group[0], group[1]) for group in groups}):
+        balance, _ = edge_transaction(conn, account, max(f"{month}-01", first_date), min(f"{month}-31", last_date), last=True)
+        closing[account, month] = balance
+        if account not in opening:
+            balance, signed = edge_transaction(conn, account, first_date, last_date)
+            opening[account] = balance - (signed or 0.0) if balance is not None else None
+    return groups, closing, opening
+
+def summarize(groups, closing, opening):
+    accounts = sorted({group[0] for group in groups})
+    months = sorted({group[1] for group in groups})
+    categories = sorted({group[2] for group in groups})
+    account_index = np.array([accounts.index(group[0]) for group in groups], dtype=np.int64)
+    month_index = np.array([months.index(group[1]) for group in groups], dtype=np.int64)
+    category_index = np.array([categories.index(group[2]) for group in groups], dtype=np.int64)
+    debit = np.array([group[3] for group in groups], dtype=np.float64)
+    credit = np.array([group[4] for group in groups], dtype=np.float64)
+
+    # Month x category totals across the accounts
+    spend = np.zeros((len(months), len(categories)))
+    income = np.zeros((len(months), len(categories)))
+    counts = np.zeros((len(months), len(categories)), dtype=np.int64)
+    np.add.at(spend, (month_index, category_index), debit)
+    np.add.at(income, (month_index, category_index), credit)
+    np.add.at(counts, (month_index, category_index), [group[5] for group in groups])
+
+    # Running net flow per account is a cumulative sum along the months; the running balance adds the balance before
+    # the account's first transaction, so it can be checked against the statement's own balance
+    flow = np.zeros((len(accounts), len(months)))
+    np.add.at(flow, (account_index, month_index), credit - debit)
+    running = np.cumsum(flow, axis=1)
+    openings = np.array([opening.get(account) for account in accounts], dtype=np.float64)
+    running_balance = running + np.nan_to_num(openings)[:, None]
+
+    return {
+        "months": months,
+        "categories": categories,
+        "spend": spend.round(2).tolist(),
+        "income": income.round(2).tolist(),
+        "transactions": counts.tolist(),
+        "closing": [
+            {"account": account, "month": month,
+             "net_flow": round(float(running[accounts.index(account), months.index(month)]), 2),
+             "running_balance": round(float(running_balance[accounts.index(account), months.index(month)]), 2),
+             "statement_balance": statement_balance}
+            for (account, month), statement_balance in closing.items()
+        ],
+    }
+
+def print_report(report):
+    months, categories = report['months'], report['categories']
+    widths = [max(len(category), 12) for category in categories]
+    print("Spend per category and month (debits)")
+    print(f"{'Month':<8}  " + "  ".join(f"{category:>{width}}" for category, width in zip(categories, widths)) +
+          f"  {'Total':>14}")
+    for month, row in zip(months, report['spend']):
+        print(f"{month:<8}  " + "  ".join(f"{value:>{width},.2f}" for value, width in zip(row, widths)) +
+              f"  {sum(row):>14,.2f}")
+
+    print("\nIncome per month (credits)")
+    for month, row in zip(months, report['income']):
+        print(f"{month:<8}  {sum(row):>12,.2f}")
+
+    print("\nRunning balance per account at month end")
+    print(f"{'Account':<20}  {'Month':<8}  {'Net flow':>14}  {'Running':>14}  {'Statement':>14}")
+    for row in report['closing']:
+        statement = f"{row['statement_balance']:>14,.2f}" if row['statement_balance'] is not None else f"{'':>14}"
+        print(f"{row['account']:<20}  {row['month']:<8}  {row['net_flow']:>14,.2f}  {row['running_balance']:>14,.2f}  "
+              f"{statement}")
+
+def report_command(args):
+    if np is None:
+        raise ImportError("The report requires numpy (pip install numpy)")
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.store)
+    try:
+        totals = load_totals(conn, account=args.account, start=args.start, end=args.end)
+    finally:
+        conn.close()
+    loaded = time.perf_counter()
+    report = summarize(*totals)
+    finished = time.perf_counter()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Report saved as {args.json}")
+    else:
+        print_report(report)
+    logger.info(f"Summarized {sum(map(sum, report['transactions']))} transactions in {finished - started:.3f}s "
+                f"(queries {loaded - started:.3f}s, running balances {finished - loaded:.3f}s)")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Query the store of categorized transactions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report = subparsers.add_parser("report", help="Spend per category per month and running balances per account")
+    report.add_argument("--store", required=True, help="Path to the SQLite transaction store")
+    report.add_argument("--account", help="Only include this account number")
+    report.add_argument("--from", dest="start", help="Only include transactions on or after this date (YYYY-MM-DD)")
+    report.add_argument("--to", dest="end", help="Only include transactions on or before this date (YYYY-MM-DD)")
+    report.add_argument("--json", help="Write the report as JSON to this path instead of printing it")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report_command(args)
+
+if __name__ == "__main__":
+    main()